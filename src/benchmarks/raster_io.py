@@ -0,0 +1,75 @@
+"""Compare single pixel and tile reads from a Daily_*.tif as delivered with its tiled copy.
+
+Files are opened once, like `raster_pool` keeps them open. Tile reads are the
+`TILE_SIZE` windows the window backend's sampler reads.
+
+Usage (from the repository root, with the rasters in data/):
+    python3 src/benchmarks/raster_io.py [method] [points]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.raster_data import TILE_SIZE, TILED_DIR, raster_path  # noqa: E402
+from utils.raster_ingest import open_raster, write_tiled  # noqa: E402
+
+
+def read_full_bands(path: str, rows: np.ndarray, cols: np.ndarray) -> float:
+    """The old pattern: open the file and read every band in full for each pixel."""
+    start = time.perf_counter()
+    for row, col in zip(rows, cols):
+        with rasterio.open(path) as src:
+            [src.read(band)[row, col] for band in range(1, src.count + 1)]
+    return (time.perf_counter() - start) / len(rows)
+
+
+def read_windows(path: str, rows: np.ndarray, cols: np.ndarray, size: int) -> float:
+    """Read the `size` x `size` window of all bands that holds each pixel, aligned to `size`."""
+    with rasterio.open(path) as src:
+        start = time.perf_counter()
+        for row, col in zip(rows, cols):
+            row_off, col_off = row // size * size, col // size * size
+            src.read(window=Window(col_off, row_off, min(size, src.width - col_off), min(size, src.height - row_off)))
+        return (time.perf_counter() - start) / len(rows)
+
+
+def describe(path: str) -> str:
+    with rasterio.open(path) as src:
+        return (
+            f"{os.path.getsize(path) / 2**20:.1f} MiB, blocks {src.block_shapes[0]}, "
+            f"interleave {src.profile.get('interleave')}, compress {src.profile.get('compress')}"
+        )
+
+
+def main():
+    method = sys.argv[1] if len(sys.argv) > 1 else "Utah"
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    path = raster_path(method)
+    raster = open_raster(method)
+    try:
+        tiled = os.path.join(TILED_DIR, write_tiled(method, [raster])[method]["file"])
+    finally:
+        raster.dataset.close()
+    with rasterio.open(path) as src:
+        rng = np.random.default_rng(0)
+        rows = rng.integers(0, src.height, points)
+        cols = rng.integers(0, src.width, points)
+
+    print(f"original: {describe(path)}")
+    print(f"tiled:    {describe(tiled)}")
+    full_points = min(points, 10)
+    print(f"full band reads, original: {read_full_bands(path, rows[:full_points], cols[:full_points]) * 1000:.2f} ms/pixel")
+    for name, size in (("pixel", 1), ("tile", TILE_SIZE)):
+        print(f"{name} reads, original: {read_windows(path, rows, cols, size) * 1000:.2f} ms/{name}")
+        print(f"{name} reads, tiled:    {read_windows(tiled, rows, cols, size) * 1000:.2f} ms/{name}")
+    os.remove(tiled)
+
+
+if __name__ == "__main__":
+    main()
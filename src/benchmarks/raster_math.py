@@ -0,0 +1,59 @@
+"""Compare per-pixel Python sums of raster time series with the batched sums of utils.raster_math.
+
+Runs on synthetic bands, no data files needed:
+    python3 src/benchmarks/raster_math.py [bands] [pixels]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import raster_math  # noqa: E402
+
+
+def timed(fn, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def python_sums(values: np.ndarray) -> list[float]:
+    """The old pattern: one pixel at a time, dropping the NaN bands before summing."""
+    sums = []
+    for i in range(values.shape[1]):
+        series = values[:, i]
+        sums.append(float(series[~np.isnan(series)].sum(dtype=np.float64)))
+    return sums
+
+
+def python_suffix_sums(values: np.ndarray, starts: list[int]) -> list[list[float]]:
+    """Sum from every start band, one pixel and start at a time."""
+    return [[float(np.nansum(values[start:, i], dtype=np.float64)) for start in starts] for i in range(values.shape[1])]
+
+
+def main():
+    bands = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    pixels = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 24, (bands, pixels)).astype(np.float32)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    starts = [0, 3, 10, 24, 31, 38, 45]
+
+    seconds, expected = timed(python_sums, values)
+    print(f"sum, per pixel:         {seconds * 1000:8.1f} ms")
+    seconds, result = timed(raster_math.nansum, values)
+    print(f"sum, nansum:            {seconds * 1000:8.1f} ms")
+    assert np.allclose(result, expected)
+
+    seconds, expected = timed(python_suffix_sums, values, starts)
+    print(f"suffix sums, per pixel: {seconds * 1000:8.1f} ms")
+    seconds, result = timed(lambda: raster_math.nancumsum(values, reverse=True)[starts])
+    print(f"suffix sums, nancumsum: {seconds * 1000:8.1f} ms")
+    assert np.allclose(result.T, expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare rendering the weather and spring frost tables with wkhtmltoimage and with Pillow.
+
+Pillow needs libraqm for the Persian text and the fonts of `TABLE_FONT`/`TABLE_FONT_BOLD`.
+
+Usage (from the repository root):
+    python3 src/benchmarks/table_render.py [tables]
+"""
+import asyncio
+import os
+import resource
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["TABLE_RENDERER"] = "wkhtmltoimage"  # table_generator's functions take the HTML path
+
+from utils import table_painter  # noqa: E402
+from utils.renderer import RendererError, renderer  # noqa: E402
+from utils.table_generator import spring_frost_table, weather_table  # noqa: E402
+
+DAYS = [f"1403/01/{day:02d}" for day in range(1, 8) for _ in range(2)]
+WEATHER = {
+    "days": DAYS,
+    "source": ["OpenMeteo", "آباد"] * 7,
+    "tmin": [3, 2] * 7,
+    "tmax": [18, 17] * 7,
+    "rh": [45, 40] * 7,
+    "wind_direction": ["شمال", "شمال غرب"] * 7,
+    "wind_speed": [12, 10] * 7,
+    "rain_sum": [0.5, 0] * 7,
+    "snow_sum": [0, 0] * 7,
+    "precip_probability": [20, "--"] * 7,
+    "direct_comparisons": 3,
+}
+FROST = [("1403/01/01", 0, 0, 1, 1, 2, 2, 3, 0), ("1403/01/02", 1, 0, 0, 0, 3, 1, 2, 2), ("1403/01/03", 2, 1, 3, 2, 0, 0, 1, 1)]
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process and of its finished children, wkhtmltoimage runs in children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+async def measure(tables: int, render) -> tuple[float, float]:
+    """Wall and CPU milliseconds per table of `tables` renders one after the other."""
+    await render()
+    start, cpu = time.perf_counter(), cpu_seconds()
+    for _ in range(tables):
+        await render()
+    return (time.perf_counter() - start) * 1000 / tables, (cpu_seconds() - cpu) * 1000 / tables
+
+
+async def main():
+    tables = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for name, html, painted in [
+        ("weather", lambda: weather_table(**WEATHER), lambda: renderer.paint(partial(table_painter.weather_table, **WEATHER))),
+        ("frost", lambda: spring_frost_table(iter(FROST), []), lambda: renderer.paint(table_painter.spring_frost_table, FROST, [])),
+    ]:
+        try:
+            wall, cpu = await measure(tables, html)
+            print(f"{name} wkhtmltoimage: {wall:7.1f} ms/table wall, {cpu:7.1f} ms/table CPU")
+        except (OSError, RendererError) as e:
+            print(f"{name} wkhtmltoimage: not available ({e})")
+        if table_painter.available():
+            wall, cpu = await measure(tables, painted)
+            print(f"{name} Pillow:        {wall:7.1f} ms/table wall, {cpu:7.1f} ms/table CPU")
+        else:
+            print(f"{name} Pillow:        not available (libraqm or the fonts are missing)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
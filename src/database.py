@@ -23,6 +23,7 @@ class Database:
         self.dialog_collection = self.db["dialogCollection"]
         self.sms_collection = self.db["smsCollection"]
         self.weather_collection = self.db["weatherCollection"]
+        self.raster_results_collection = self.db["rasterResultsCollection"]
         self.app_collection = self.db["webappUserCollection"]
 
     def check_if_user_exists(self, user_id: int, raise_exception: bool = False):
@@ -610,6 +611,22 @@ class Database:
         cursor = self.user_collection.aggregate(pipeline) # 
         return list(cursor)
         
+    def save_raster_results(self, results: list[dict[str, any]]) -> None:
+        """
+        Upserts the precomputed chilling hours and GDD of many farms in one bulk write.
+        Each result needs the keys `userID` and `farm_name`.
+        """
+        if not results:
+            return
+        operations = [
+            pymongo.UpdateOne({"_id": {"userID": result["userID"], "farm_name": result["farm_name"]}}, {"$set": result}, upsert=True)
+            for result in results
+        ]
+        self.raster_results_collection.bulk_write(operations, ordered=False)
+
+    def get_raster_results(self, user_id: int, farm_name: str) -> dict | None:
+        return self.raster_results_collection.find_one({"_id": {"userID": user_id, "farm_name": farm_name}})
+
     def get_users_without_phone(self):
         pipeline = [
             { "$match": {"$or": [ {"phone-number": None}, {"phone-number": ""} ] } },
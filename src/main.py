@@ -33,6 +33,9 @@ from utils.add_conv import add_farm_conv_handler
 from utils.edit_conv import edit_farm_conv_handler
 from utils.weather_conv import weather_req_conv_handler
 from utils.weather_api import load_weather_to_db
+from utils.data_watcher import watch_data_dir
+from utils.raster_results import compute_raster_results, ingest_rasters_job
+from utils.geo_pool import geo_pool
 from utils.delete_conv import delete_conv_handler
 from utils.register_conv import register_conv_handler
 from utils.view_conv import view_conv_handler
@@ -211,7 +214,7 @@ def main():
     application.add_handler(broadcast_handler)
     application.add_handler(CommandHandler("stats", bot_stats))
     application.add_handler(CommandHandler("today", backup_send))
-    application.add_handler(CallbackQueryHandler(stats_buttons, pattern="^(member_count|member_count_change|excel_download|block_count|no_location_count|no_phone_count)$"))
+    application.add_handler(CallbackQueryHandler(stats_buttons, pattern="^(member_count|member_count_change|excel_download|block_count|no_location_count|no_phone_count|data_stats)$"))
     application.add_handler(CallbackQueryHandler(show_remaining_hours, pattern="^chilling-hours"))
     application.add_handler(cq_set_location_handler)
     application.add_handler(CommandHandler("start", start))
@@ -233,8 +236,17 @@ def main():
         # first=5
         job_kwargs={"misfire_grace_time": 300}
     )
+    job_queue.run_repeating(compute_raster_results,
+        interval=datetime.timedelta(days=1),
+        first=datetime.time(3, 0),
+        job_kwargs={"misfire_grace_time": 300}
+    )
+    job_queue.run_repeating(watch_data_dir, interval=60, first=1)
+    job_queue.run_repeating(ingest_rasters_job, interval=60, first=10)
     job_queue.run_once(send_up_notice, when=5)
     
+    # Start the geo workers before the event loop starts
+    geo_pool.start()
     # Start the bot
     application.run_polling()
 
@@ -30,6 +30,7 @@ from .keyboards import (
     land_type_keyboard
 )
 from .logger import logger
+from .farm_cells import assign_cells
 from .sms_funcs import sms_incomplete_farm
 from .number_transformer import extract_number
 # Constants for ConversationHandler states
@@ -488,6 +489,7 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         db.set_user_attribute(user.id, f"farms.{farm_name}.location.latitude", location.latitude)
         db.set_user_attribute(user.id, f"farms.{farm_name}.location.longitude", location.longitude)
+        assign_cells(user.id, farm_name, location.longitude, location.latitude)
         db.set_user_attribute(user.id, f"farms.{farm_name}.location-method", "User sent location")
 
         db.log_activity(user.id, "finished add farm - gave location", farm_name)
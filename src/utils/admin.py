@@ -25,6 +25,11 @@ from .keyboards import (
     choose_role
 )
 from .regular_jobs import send_todays_data
+from .geo_pool import geo_pool, GeoPoolError
+from .geo_tasks import data_stats
+from .raster_data import raster_pool
+from .render_cache import render_cache
+from .renderer import renderer
 
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -306,6 +311,14 @@ async def stats_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif stat.data == "no_phone_count":
         no_phone_users = db.get_users_without_phone()
         await context.bot.send_message(chat_id=id, text=f"تعداد بدون شماره تلفن: {len(no_phone_users)}")
+    elif stat.data == "data_stats":
+        try:
+            worker_stats = await geo_pool.run(data_stats)
+        except GeoPoolError:
+            worker_stats = {}
+        sections = {"bot geo pool": geo_pool.stats(), "bot raster handles": raster_pool.stats(), "bot render cache": render_cache.stats(), "bot renderer": renderer.stats(), **{f"worker {name}": values for name, values in worker_stats.items()}}
+        text = "\n".join(f"{name}: " + ", ".join(f"{key}={value}" for key, value in values.items()) for name, values in sections.items())
+        await context.bot.send_message(chat_id=id, text=f"آمار کش داده‌ها:\n{text}")
 
 
 broadcast_handler = ConversationHandler(
@@ -11,15 +11,17 @@ from telegram.constants import ParseMode
 
 import datetime
 import jdatetime
-import rasterio
 from rasterio.errors import RasterioIOError
-from rasterio.transform import rowcol
 import warnings
 
 import database
 from pg_sync import update_farm_in_postgres
 
 from .logger import logger
+from .geo_pool import geo_pool, GeoPoolError, BUSY_MESSAGE
+from .raster_data import calculate_chilling_hours
+from .raster_results import stored_chilling_hours
+from .farm_cells import require_coverage
 from .keyboards import (
     farms_list_reply,
     automn_month,
@@ -27,6 +29,8 @@ from .keyboards import (
     get_product_keyboard
 )
 from .table_generator import chilling_hours_table, remaining_chilling_hours_table
+from .render_cache import send_cached_photo
+from .renderer import RendererError
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -37,41 +41,6 @@ MENU_CMDS = ['✍️ ثبت نام', '📤 دعوت از دیگران', '🖼 م
 db = database.Database()
 
 
-# Calculate chilling hours
-def calculate_chilling_hours(automn_time: str, longitude: float, latitude: float) -> dict[str, float]:
-    methods = ['Chilling_Hours', 'Chilling_Hours_7', 'Dynamic', 'Utah']
-    hours = {}
-    for method in methods:
-        with rasterio.open(f"data/Daily_{method}.tif") as src:
-            row, col = rowcol(src.transform, longitude, latitude)
-            
-            pixel_values = []
-            for band in range(1, src.count + 1):
-                pixel_values.append(src.read(band)[row, col])
-        automn_time_to_start_band_index = {
-            "هفته اول - آبان": 0,
-            "هفته دوم - آبان": 0,
-            "هفته سوم - آبان": 3,
-            "هفته چهارم - آبان": 10,
-            "هفته اول - آذر": 24,
-            "هفته دوم - آذر": 31,
-            "هفته سوم - آذر": 38,
-            "هفته چهارم - آذر": 45,
-            "هفته اول آبان": 0,
-            "هفته دوم آبان": 0,
-            "هفته سوم آبان": 3,
-            "هفته چهارم آبان": 10,
-            "هفته اول آذر": 24,
-            "هفته دوم آذر": 31,
-            "هفته سوم آذر": 38,
-            "هفته چهارم آذر": 45,
-        }
-
-        start_band_index = automn_time_to_start_band_index.get(automn_time)    
-        hours[method] = round(sum(pixel_values[start_band_index:]))
-    return hours
-
-
 async def show_remaining_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Callback Query that generates a table showing the user how many hours remain
     for their farm
@@ -95,11 +64,15 @@ async def show_remaining_hours(update: Update, context: ContextTypes.DEFAULT_TYP
     ]
     complete_hours = [1000, 600, 800, 800, 1200, 1200, 1400]
     hours_difference = [hours - el for el in complete_hours]
-    remaining_chilling_hours_table(pesteh_types, complete_hours, hours_difference, hours)
+    # the table shows yesterday's date, so it only changes with the hours and the day
+    key = ("remaining-hours", hours, jdatetime.date.today().strftime("%Y/%m/%d"))
     try:
         caption = f"ساعات باقیمانده نیاز سرمایی ارقام مختلف پسته در باغ شما بر اساس روش <b>0 تا 7</b>"
-        with open('table.png', 'rb') as image_file:
-            await context.bot.send_photo(chat_id=user.id, photo=image_file, caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30)
+        await send_cached_photo(
+            context.bot, user.id, key,
+            lambda: remaining_chilling_hours_table(pesteh_types, complete_hours, hours_difference, hours),
+            caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30,
+        )
         
         db.log_activity(user.id, "received remaining hours info")
     except Forbidden or BadRequest:
@@ -153,17 +126,18 @@ async def ask_automn_month(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user_farms[farm].get("location", {}).get("longitude") and user_farms[farm].get("location", {}).get("latitude"):
             reply_text = f"این ساعت‌ها با توجه به موقعیت و زمان خزان ثبت‌شده توسط شما <b>({user_farms[farm].get('automn-time')})</b> برای باغ شما: #<b>{farm.replace(' ', '_')}</b> محاسبه شده‌اند"
             try:
-                hours = calculate_chilling_hours(user_farms[farm].get("automn-time"), user_farms[farm].get("location", {}).get("longitude"), user_farms[farm].get("location", {}).get("latitude"))
-                chilling_hours_table(["صفر تا هفت", "زیر هفت", "دینامیک", "یوتا"],
+                require_coverage(user.id, farm, user_farms[farm], "chilling")
+                hours = stored_chilling_hours(user.id, farm, user_farms[farm])
+                if hours is None:
+                    hours = await geo_pool.run(calculate_chilling_hours, user_farms[farm].get("automn-time"), user_farms[farm].get("location", {}).get("longitude"), user_farms[farm].get("location", {}).get("latitude"), share=True)
+                table = await chilling_hours_table(["صفر تا هفت", "زیر هفت", "دینامیک", "یوتا"],
                                     [(jdatetime.date.today() - jdatetime.timedelta(days=1 )).strftime("%Y/%m/%d")] * 4,
-                                    [hours["Chilling_Hours"], hours["Chilling_Hours_7"], hours["Dynamic"], hours["Utah"]],
-                                    "chill-table.png")
+                                    [hours["Chilling_Hours"], hours["Chilling_Hours_7"], hours["Dynamic"], hours["Utah"]])
                 data = f"chilling-hours\n{hours['Chilling_Hours']}"
                 keyboard = InlineKeyboardMarkup([
                     [InlineKeyboardButton("مشاهده نیازمندی رقم‌های مختلف", callback_data=data)]
                 ])
-                with open('chill-table.png', 'rb') as image_file:
-                    await context.bot.send_photo(chat_id=user.id, photo=image_file, caption=reply_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+                await context.bot.send_photo(chat_id=user.id, photo=table, caption=reply_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
                 # db.log_activity(user.id, "automn time of farm was already set", farm)
                 db.log_activity(user.id, "received chilling hours report", hours)
                 # await update.message.reply_text(reply_text, reply_markup=db.find_start_keyboard(user.id))
@@ -180,6 +154,9 @@ async def ask_automn_month(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 """
                 await context.bot.send_message(chat_id=user.id, text=msg, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML)
                 return ConversationHandler.END
+            except (GeoPoolError, RendererError):
+                await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+                return ConversationHandler.END
                 
         else:
             db.log_activity(user.id, "error - chose farm for automn time" , farm)
@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+from rasterio.transform import Affine
+
+COVERAGE_RESOLUTION = 0.05  # degrees, cell size of the masks built from grid points
+
+
+class CoverageMask:
+    """Boolean lon/lat lattice of the area a product has data for.
+
+    A location is covered if it falls in a `True` cell, so answering "outside the
+    service area" is a bounds check and one array read. Masks built from grid points
+    are conservative: every location within `radius` of a point is covered, some
+    locations a little further away are too.
+    """
+    def __init__(self, lon0: float, lat0: float, dlon: float, dlat: float, mask: np.ndarray, radius: float = 0.0) -> None:
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.dlon = dlon
+        self.dlat = dlat
+        self.mask = mask
+        self.radius = radius
+
+    @classmethod
+    def from_points(cls, longitudes: np.ndarray, latitudes: np.ndarray, radius: float, resolution: float = COVERAGE_RESOLUTION) -> "CoverageMask":
+        """Cover every location within `radius` degrees of a point."""
+        longitudes, latitudes = np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64)
+        if len(longitudes) == 0:
+            return cls(0.0, 0.0, resolution, resolution, np.zeros((0, 0), dtype=bool), radius)
+        lon0, lat0 = float(longitudes.min()) - radius, float(latitudes.min()) - radius
+        # a location within `radius` of a point is at most `reach` cells from the point's cell
+        reach = math.floor(radius / resolution) + 1
+        cols = np.floor((longitudes - lon0) / resolution).astype(np.int64) + reach
+        rows = np.floor((latitudes - lat0) / resolution).astype(np.int64) + reach
+        lon0, lat0 = lon0 - reach * resolution, lat0 - reach * resolution
+        mask = np.zeros((int(rows.max()) + reach + 1, int(cols.max()) + reach + 1), dtype=bool)
+        for dr in range(-reach, reach + 1):
+            for dc in range(-reach, reach + 1):
+                mask[rows + dr, cols + dc] = True
+        return cls(lon0, lat0, resolution, resolution, mask, radius)
+
+    @classmethod
+    def from_raster(cls, transform: Affine, has_data: np.ndarray) -> "CoverageMask":
+        """Cover the pixels of a raster that are `True` in `has_data` `(rows, cols)`."""
+        return cls(transform.c, transform.f, transform.a, transform.e, has_data)
+
+    def covers(self, longitude: float, latitude: float) -> bool:
+        row = math.floor((latitude - self.lat0) / self.dlat)
+        col = math.floor((longitude - self.lon0) / self.dlon)
+        rows, cols = self.mask.shape
+        return 0 <= row < rows and 0 <= col < cols and bool(self.mask[row, col])
+
+    def save(self, file, **meta: float) -> None:
+        """Write the mask to an `.npz` file (a path or a binary file object), along with numeric `meta` values."""
+        np.savez(file, mask=self.mask, origin=[self.lon0, self.lat0, self.dlon, self.dlat, self.radius], **meta)
+
+    @classmethod
+    def load(cls, path: str) -> tuple["CoverageMask", dict[str, float]]:
+        """Return the mask stored in `path` and its `meta` values."""
+        with np.load(path) as f:
+            lon0, lat0, dlon, dlat, radius = (float(value) for value in f["origin"])
+            meta = {key: float(f[key]) for key in f.files if key not in ("mask", "origin")}
+            return cls(lon0, lat0, dlon, dlat, f["mask"], radius), meta
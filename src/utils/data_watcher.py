@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import os
+import shutil
+import time
+
+from telegram.ext import ContextTypes
+
+from .logger import logger
+from .grid_index import GridIndex, load_grid
+from .grid_products import GRID_PRODUCTS, get_product
+from .grid_snapshot import DATA_DIR, SNAPSHOT_DIR, SNAPSHOT_KEEP_DAYS
+
+SETTLE_SECONDS = 60  # a file is considered completely written once it hasn't changed for this long
+
+_rejected: dict[str, float] = {}  # path -> mtime of a version that failed validation
+_ready_events: dict[tuple[str, str], asyncio.Event] = {}
+
+
+def find_new_grids(data_dir: str = DATA_DIR) -> dict[str, tuple[str, GridIndex]]:
+    """Load, validate and index the newest complete file of every product that is
+    newer than its active grid, or is the active day's file rewritten (e.g. a corrected
+    upload). Meant to run outside the event loop.
+    """
+    new_grids = {}
+    for product in GRID_PRODUCTS.values():
+        newest = product.newest_file(data_dir)
+        if newest is None:
+            continue
+        date, path = newest
+        mtime = os.path.getmtime(path)
+        active = product.active
+        if active is not None and (active.date > date or active.date == date and active.grid.snapshot.source_mtime == mtime):
+            continue
+        if time.time() - mtime < SETTLE_SECONDS or _rejected.get(path) == mtime:
+            continue
+        try:
+            grid = load_grid(product.name, date, path)
+            product.validate(grid, date)
+        except Exception as e:
+            logger.error(f"rejected {path}: {e}")
+            _rejected[path] = mtime
+            continue
+        new_grids[product.name] = date, grid
+    return new_grids
+
+
+def remove_old_snapshots(snapshot_dir: str = SNAPSHOT_DIR) -> list[str]:
+    """Remove the grid snapshots that no request can use any more and return their names.
+    A snapshot is kept while its product may still serve its day (`max_age_days`) plus
+    `SNAPSHOT_KEEP_DAYS`, and always while it is the active day. Workers that still map a
+    removed snapshot keep reading it until they drop it, and a removed day that is asked
+    for again is rebuilt from its file in `data/`. Meant to run outside the event loop.
+    """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    today = datetime.date.today()
+    removed = []
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        if name.startswith("."):
+            # left behind by an interrupted write
+            if time.time() - os.path.getmtime(path) > 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        for product in GRID_PRODUCTS.values():
+            match = product.file_regex.match(f"{name}.geojson")
+            if match is None:
+                continue
+            date = match.group(1)
+            age = (today - datetime.datetime.strptime(date, "%Y%m%d").date()).days
+            active = product.active is not None and product.active.date == date
+            if not active and age > product.max_age_days + SNAPSHOT_KEEP_DAYS:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+            break
+    if removed:
+        logger.info(f"removed old grid snapshots {removed}")
+    return removed
+
+
+async def watch_data_dir(context: ContextTypes.DEFAULT_TYPE):
+    """Repeating job that publishes new grids once they have been completely written and
+    indexed, and then drops the snapshots that are too old to be used.
+    """
+    loop = asyncio.get_event_loop()
+    new_grids = await loop.run_in_executor(None, find_new_grids)
+    now = datetime.datetime.now()
+    for product, (date, grid) in new_grids.items():
+        get_product(product).publish(date, grid, now)
+        logger.info(f"data for {product} {date} ready at {now.strftime('%H:%M:%S')}")
+        for key, event in list(_ready_events.items()):
+            if key[0] == product and key[1] <= date:
+                event.set()
+    if new_grids:
+        await loop.run_in_executor(None, remove_old_snapshots)
+
+
+def _ready_event(product: str, date: str) -> asyncio.Event:
+    event = _ready_events.get((product, date))
+    if event is None:
+        event = _ready_events[(product, date)] = asyncio.Event()
+        # forget the events of old days
+        for key in [key for key in _ready_events if key[1] < date]:
+            if _ready_events[key].is_set():
+                _ready_events.pop(key)
+    return event
+
+
+async def wait_for_data(product: str, date: str, timeout: float | None = None) -> bool:
+    """Wait until the grid of `product` for `date` (`%Y%m%d`) is active.
+    Returns False if it wasn't ready within `timeout` seconds.
+    """
+    active = get_product(product).active
+    if active is not None and active.date >= date:
+        return True
+    try:
+        await asyncio.wait_for(_ready_event(product, date).wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
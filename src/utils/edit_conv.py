@@ -31,6 +31,7 @@ from .keyboards import (
     )
 from pg_sync import update_farm_in_postgres
 from .number_transformer import extract_number
+from .farm_cells import assign_cells
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -356,6 +357,7 @@ async def handle_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             db.set_user_attribute(
                 user.id, f"farms.{farm}.location.latitude", new_location.latitude
             )
+            assign_cells(user.id, farm, new_location.longitude, new_location.latitude)
             db.set_user_attribute(
                 user.id, f"farms.{farm}.location-method", "User sent location via edit"
             )
@@ -0,0 +1,86 @@
+import database
+
+from .grid_products import GRID_PRODUCTS, ActiveGrid
+from .raster_data import CHILLING_METHODS, GDD_METHODS, raster_coverage, raster_versions
+
+db = database.Database()
+
+# coverage of the raster products, each covers a location if every one of its methods has data there
+RASTER_PRODUCTS = {"chilling": CHILLING_METHODS, "gdd": GDD_METHODS}
+
+
+def _cell_entry(active: ActiveGrid, longitude: float, latitude: float) -> dict:
+    return {
+        "cell": active.grid.nearest(longitude, latitude, active.product.threshold),
+        "grid": active.grid.snapshot.grid_id,
+        "location": [longitude, latitude],
+    }
+
+
+def _grid_coverage_entry(entry: dict) -> dict:
+    return {"covered": entry["cell"] is not None, "version": entry["grid"], "location": entry["location"]}
+
+
+def _raster_coverage_entry(name: str, longitude: float, latitude: float) -> dict | None:
+    """`None` while a method's coverage mask isn't written for its current raster."""
+    methods = RASTER_PRODUCTS[name]
+    masks = [raster_coverage(method) for method in methods]
+    if any(mask is None for mask in masks):
+        return None
+    return {
+        "covered": all(mask.covers(longitude, latitude) for mask in masks),
+        "version": raster_versions(methods),
+        "location": [longitude, latitude],
+    }
+
+
+def assign_cells(user_id: int, farm: str, longitude: float, latitude: float) -> None:
+    """Store the farm's grid point in every active product as `farms.<farm>.cells.<product>`
+    and whether each grid and raster product covers the farm as `farms.<farm>.coverage.<product>`.
+    Call whenever a farm's location is set, it replaces the cells of the old location.
+    """
+    cells, coverage = {}, {}
+    for product in GRID_PRODUCTS.values():
+        active = product.active
+        if active is not None:
+            cells[product.name] = _cell_entry(active, longitude, latitude)
+            coverage[product.name] = _grid_coverage_entry(cells[product.name])
+    for name in RASTER_PRODUCTS:
+        entry = _raster_coverage_entry(name, longitude, latitude)
+        if entry is not None:
+            coverage[name] = entry
+    db.set_user_attribute(user_id, f"farms.{farm}.cells", cells)
+    db.set_user_attribute(user_id, f"farms.{farm}.coverage", coverage)
+
+
+def farm_cell(user_id: int, farm: str, farm_document: dict, active: ActiveGrid) -> int | None:
+    """Return the farm's grid point in `active`, `None` if the farm is out of the grid's range.
+    The stored cell is used when it was computed for the same grid points and location,
+    otherwise the cell is looked up and stored for the next request.
+    """
+    longitude = farm_document.get("location", {}).get("longitude")
+    latitude = farm_document.get("location", {}).get("latitude")
+    entry = farm_document.get("cells", {}).get(active.product.name)
+    if entry and entry.get("grid") == active.grid.snapshot.grid_id and entry.get("location") == [longitude, latitude]:
+        return entry["cell"]
+    entry = _cell_entry(active, longitude, latitude)
+    db.set_user_attribute(user_id, f"farms.{farm}.cells.{active.product.name}", entry)
+    db.set_user_attribute(user_id, f"farms.{farm}.coverage.{active.product.name}", _grid_coverage_entry(entry))
+    return entry["cell"]
+
+
+def require_coverage(user_id: int, farm: str, farm_document: dict, name: str) -> None:
+    """Raise `IndexError` if the raster product `name` ("chilling" or "gdd") has no data at
+    the farm, like the raster reads do, but without reading the rasters. The stored flag is
+    used while it matches the farm's location and the rasters, otherwise it is recomputed.
+    """
+    longitude = farm_document.get("location", {}).get("longitude")
+    latitude = farm_document.get("location", {}).get("latitude")
+    entry = farm_document.get("coverage", {}).get(name)
+    if not entry or entry.get("location") != [longitude, latitude] or entry.get("version") != raster_versions(RASTER_PRODUCTS[name]):
+        entry = _raster_coverage_entry(name, longitude, latitude)
+        if entry is None:
+            return
+        db.set_user_attribute(user_id, f"farms.{farm}.coverage.{name}", entry)
+    if not entry["covered"]:
+        raise IndexError(f"({longitude}, {latitude}) is outside the {name} rasters")
@@ -0,0 +1,197 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+
+from .logger import logger
+from . import geo_tasks
+
+GEO_POOL_WORKERS = int(os.environ.get("GEO_POOL_WORKERS", 2))
+GEO_POOL_MAX_PENDING = int(os.environ.get("GEO_POOL_MAX_PENDING", 32))  # submitted but unfinished tasks
+# seconds. A worker can't be interrupted, a task that times out keeps its worker and its
+# pending slot until it finishes. Once every worker is stuck on such a task the pool is
+# replaced, which also fails the other tasks that are running at that moment.
+GEO_TASK_TIMEOUT = float(os.environ.get("GEO_TASK_TIMEOUT", 30))
+
+BUSY_MESSAGE = "سرور در حال حاضر شلوغ است. لطفا چند دقیقه دیگر دوباره تلاش کنید."
+
+
+class GeoPoolError(Exception):
+    """Base class of the errors a handler gets instead of a geo task's result."""
+
+
+class GeoPoolBusy(GeoPoolError):
+    """Raised when too many tasks are already waiting for the workers."""
+
+
+class GeoTaskTimeout(GeoPoolError):
+    """Raised when a task didn't finish within its timeout."""
+
+
+class GeoWorkerLost(GeoPoolError):
+    """Raised when a worker died (e.g. killed for memory) or was recycled while running the task."""
+
+
+class _SharedTask:
+    """A pending task and the number of callers waiting for it."""
+    def __init__(self, executor: ProcessPoolExecutor, future: Future) -> None:
+        self.executor = executor
+        self.future = future
+        self.waiters = 1
+
+
+class GeoPool:
+    """Process pool for the grid and raster reads, so a slow lookup doesn't block the event loop.
+
+    Task functions must be importable module level functions from database-free
+    modules (`geo_tasks`, `raster_data`, `raster_ingest`). Workers are started once and reused, so the
+    grids they load stay cached between requests. They are forked from a fork server
+    that has only imported `geo_tasks`, never from the bot, whose threads may hold locks
+    when a worker is replaced. Like any spawned process, a worker imports the bot's main
+    module without running `main()`.
+    """
+    def __init__(self, workers: int = GEO_POOL_WORKERS, max_pending: int = GEO_POOL_MAX_PENDING, timeout: float = GEO_TASK_TIMEOUT) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor: ProcessPoolExecutor | None = None
+        self.restarts = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._hung: set[Future] = set()  # timed out tasks of the current executor that are still running
+        self._warming: list[Future] = []
+        self.shared = 0  # calls that waited for an identical pending task
+        self._shared: dict[tuple, _SharedTask] = {}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([geo_tasks.__name__])
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=geo_tasks.init_worker,
+            initargs=(self.workers,),
+        )
+        # workers are started on demand, one for each submit that finds none idle
+        self._warming = [executor.submit(geo_tasks.warm_up) for _ in range(self.workers)]
+        return executor
+
+    def start(self) -> None:
+        """Start the workers, call before the event loop so the first requests don't wait for them."""
+        if self.executor is not None:
+            return
+        self.executor = self._new_executor()
+        for future in self._warming:
+            future.result()
+        logger.info(f"started geo pool with {self.workers} workers")
+
+    def _restart(self, executor: ProcessPoolExecutor, reason: str) -> None:
+        """Replace `executor` with new workers, unless another task already did. Tasks still
+        running or queued in it fail with `BrokenExecutor`.
+        """
+        with self._lock:
+            if self.executor is not executor:
+                return
+            logger.warning(f"restarting the geo pool: {reason}")
+            # the executor has no public way to stop busy workers
+            for process in list((executor._processes or {}).values()):
+                process.kill()
+            # not cancel_futures, the queued tasks then fail like the running ones instead of
+            # being cancelled under their callers
+            executor.shutdown(wait=False)
+            self._hung = set()
+            self.restarts += 1
+            self.executor = self._new_executor()
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _submit(self, fn, args: tuple, share: bool) -> tuple[ProcessPoolExecutor, Future]:
+        """Submit `fn(*args)`, or with `share` join an identical task that is pending."""
+        key = (fn, args)
+        with self._lock:
+            shared = self._shared.get(key) if share else None
+            if shared is not None:
+                shared.waiters += 1
+                self.shared += 1
+                return shared.executor, shared.future
+        if not self._slots.acquire(blocking=False):
+            raise GeoPoolBusy(f"{self.max_pending} geo tasks are already pending")
+        executor = self.executor
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenExecutor as e:
+            self._slots.release()
+            self._restart(executor, f"a worker died: {e}")
+            raise GeoWorkerLost(f"{fn.__name__} couldn't be started, the geo pool was broken") from e
+        except Exception:
+            self._slots.release()
+            raise
+        # a task that timed out keeps its slot until the worker is actually done with it
+        future.add_done_callback(self._release)
+        if share:
+            with self._lock:
+                self._shared[key] = _SharedTask(executor, future)
+        return executor, future
+
+    def _leave(self, fn, args: tuple, future: Future, share: bool) -> None:
+        """Called when a caller stops waiting for `future`. A task nobody waits for any
+        more is no longer shared, and dropped if it hasn't started.
+        """
+        if share:
+            key = (fn, args)
+            with self._lock:
+                shared = self._shared.get(key)
+                if shared is not None and shared.future is future:
+                    shared.waiters -= 1
+                    if shared.waiters > 0:
+                        return
+                    del self._shared[key]
+        future.cancel()
+
+    async def run(self, fn, *args, timeout: float | None = None, share: bool = False):
+        """Run `fn(*args)` in a worker and return its result. Exceptions raised by
+        `fn` are re-raised here. With `share`, a call made while an identical one (same
+        `fn` and `args`) is pending waits for that task instead of submitting another,
+        e.g. two requests for farms in the same grid cell. `args` must then be hashable.
+        Raises `GeoPoolBusy` if `max_pending` tasks are unfinished and `GeoTaskTimeout`
+        if the task takes longer than `timeout` (default `GEO_TASK_TIMEOUT`) seconds.
+        """
+        if self.executor is None:
+            self.start()
+        executor, future = self._submit(fn, args, share)
+        waiter = asyncio.wrap_future(future)
+        try:
+            try:
+                # shielded, a caller that gives up doesn't cancel the task for the others
+                return await asyncio.wait_for(asyncio.shield(waiter), timeout or self.timeout)
+            finally:
+                # the error of a task nobody waits for any more isn't an unhandled one
+                waiter.add_done_callback(lambda waiter: waiter.cancelled() or waiter.exception())
+                self._leave(fn, args, future, share)
+        except asyncio.TimeoutError:
+            logger.warning(f"geo task {fn.__name__}{args} timed out")
+            with self._lock:
+                if self.executor is executor and not future.done():
+                    self._hung.add(future)
+                stuck = len(self._hung) >= self.workers
+            if stuck:
+                self._restart(executor, f"all {self.workers} workers are stuck on timed out tasks")
+            raise GeoTaskTimeout(f"{fn.__name__} didn't finish in time")
+        except BrokenExecutor as e:
+            self._restart(executor, f"a worker died: {e}")
+            raise GeoWorkerLost(f"{fn.__name__} was lost with its worker") from e
+
+    def _release(self, future: Future) -> None:
+        with self._lock:
+            self._hung.discard(future)
+        self._slots.release()
+
+    def stats(self) -> dict[str, int]:
+        return {"restarts": self.restarts, "stuck": len(self._hung), "shared": self.shared}
+
+
+geo_pool = GeoPool()
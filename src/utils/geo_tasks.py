@@ -0,0 +1,93 @@
+"""Grid lookups run by the geo worker processes.
+
+Workers are handed a product name, data date and the farm's grid point (see
+`farm_cells`) along with the id of the grid it was looked up in, rather than a loaded
+grid, and keep their own grid caches (see `grid_index.load_grid`). Keep this module and its imports free of database access.
+"""
+import datetime
+
+import numpy as np
+
+from .grid_index import grid_cache, load_grid
+from .grid_products import ActiveGrid, GridChanged, GridLookup, get_product
+from .raster_data import (
+    CHILLING_METHODS,
+    GDD_METHODS,
+    RASTER_TILE_CACHE_BYTES,
+    TileSampler,
+    batch_chilling_hours,
+    batch_gdd,
+    raster_pool,
+    raster_versions,
+    sampler,
+    warm_raster,
+)
+from .logger import logger
+
+
+def init_worker(workers: int) -> None:
+    """Run by every new worker. `RASTER_TILE_CACHE_MB` bounds the tile caches of all
+    `workers` together, each worker caches its own tiles.
+    """
+    if isinstance(sampler, TileSampler):
+        sampler.max_bytes = RASTER_TILE_CACHE_BYTES // workers
+
+
+def warm_up() -> None:
+    """Submitted once per worker at startup so the processes exist before the first request."""
+    return None
+
+
+def warm_rasters() -> None:
+    """Load the published version of every raster, submitted by `raster_ingest` after it publishes one."""
+    for method in CHILLING_METHODS + GDD_METHODS:
+        try:
+            warm_raster(method)
+        except OSError as e:
+            logger.warning(f"couldn't warm {method} up: {e}")
+
+
+def _point(product: str, date: str, cell: int, grid_id: str) -> GridLookup:
+    grid_product = get_product(product)
+    grid = load_grid(product, date, grid_product.path(date))
+    if grid.snapshot.grid_id != grid_id:
+        raise GridChanged(f"{product} {date} is grid {grid.snapshot.grid_id} in this worker, not {grid_id}")
+    return GridLookup(ActiveGrid(grid_product, date, grid, datetime.datetime.now()), cell)
+
+
+def product_series(product: str, date: str, cell: int, grid_id: str) -> dict[str, list]:
+    """Every variable's series at grid point `cell` of grid `grid_id`.
+    Raises `GridChanged` if the worker's file of the day has other grid points.
+    """
+    point = _point(product, date, cell, grid_id)
+    return {variable: point.series(variable) for variable in point.product.variables}
+
+
+def product_days(product: str, date: str, cell: int, grid_id: str, count: int) -> dict[str, list]:
+    """Every variable's values for `count` days from `date` at grid point `cell` of grid `grid_id`.
+    Raises `GridChanged` if the worker's file of the day has other grid points.
+    """
+    point = _point(product, date, cell, grid_id)
+    return {variable: point.days(variable, count) for variable in point.product.variables}
+
+
+def data_stats() -> dict[str, dict[str, int]]:
+    """Counters of the grid cache, raster handle pool and tile cache of the worker that runs this."""
+    stats = {"grid cache": grid_cache.stats(), "raster handles": raster_pool.stats()}
+    if isinstance(sampler, TileSampler):
+        stats["raster tiles"] = sampler.stats()
+    return stats
+
+
+def farms_raster_results(longitudes: list[float], latitudes: list[float]) -> dict:
+    """Chilling hours of every autumn time and GDD of many farms, along with the mtimes
+    of the rasters they were read from.
+    """
+    longitudes, latitudes = np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64)
+    # read before the rasters, results of a version published meanwhile are then only recomputed
+    sources = raster_versions(CHILLING_METHODS + GDD_METHODS)
+    return {
+        "sources": sources,
+        "chilling": batch_chilling_hours(longitudes, latitudes),
+        "gdd": batch_gdd(longitudes, latitudes),
+    }
@@ -0,0 +1,154 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+from .logger import logger
+from .coverage import CoverageMask
+from .grid_snapshot import GridSnapshot, open_snapshot
+
+THRESHOLD = 0.1  # degrees
+MAX_GRID_CACHE_BYTES = int(os.environ.get("GRID_CACHE_MB", 512)) * 2**20
+TREE_BYTES_PER_POINT = 200  # rough size of a shapely point and its tree node
+
+
+class GridIndex:
+    """Nearest point lookups over one daily grid snapshot.
+
+    Regular lon/lat grids are addressed by arithmetic on the lattice stored in their
+    snapshot. For any other grid a spatial tree is built over the snapshot's points,
+    so each farm lookup is a tree query instead of a distance scan over every grid point.
+    Locations outside the grid's coverage mask are rejected before either.
+    """
+    def __init__(self, snapshot: GridSnapshot) -> None:
+        self.snapshot = snapshot
+        self.longitudes = snapshot.longitudes
+        self.latitudes = snapshot.latitudes
+        self.layout = snapshot.layout
+        self.tree = None
+        if self.layout is None:
+            self.tree = shapely.STRtree(shapely.points(np.asarray(self.longitudes), np.asarray(self.latitudes)))
+        self.coverage = CoverageMask.from_points(self.longitudes, self.latitudes, THRESHOLD)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the grid's arrays and index."""
+        size = self.snapshot.nbytes
+        if self.tree is not None:
+            size += len(self.snapshot) * TREE_BYTES_PER_POINT
+        return size + self.coverage.mask.nbytes
+
+    def nearest(self, longitude: float, latitude: float, threshold: float = THRESHOLD) -> int | None:
+        """Return the position of the grid point closest to the location, or
+        `None` if that point is further than `threshold` degrees away.
+        """
+        if threshold <= self.coverage.radius and not self.coverage.covers(longitude, latitude):
+            return None
+        if self.layout is not None:
+            return self._nearest_on_lattice(longitude, latitude, threshold)
+        idx = self.tree.nearest(shapely.Point(longitude, latitude))
+        if idx is None:
+            return None
+        distance = np.hypot(self.longitudes[idx] - longitude, self.latitudes[idx] - latitude)
+        if distance <= threshold:
+            return int(idx)
+        return None
+
+    def _nearest_on_lattice(self, longitude: float, latitude: float, threshold: float) -> int | None:
+        layout = self.layout
+        rows, cols = layout.cells.shape
+        col = (longitude - layout.lon0) / layout.dlon
+        row = (latitude - layout.lat0) / layout.dlat
+        # the closest lattice cell is the closest point whenever the grid has a point there
+        c, r = round(col), round(row)
+        if 0 <= r < rows and 0 <= c < cols and layout.cells[r, c] >= 0:
+            idx = int(layout.cells[r, c])
+            distance = math.hypot(float(self.longitudes[idx]) - longitude, float(self.latitudes[idx]) - latitude)
+            return idx if distance <= threshold else None
+        # otherwise look through the cells within the threshold
+        c0, c1 = max(int(np.floor(col - threshold / layout.dlon)), 0), min(int(np.ceil(col + threshold / layout.dlon)), cols - 1)
+        r0, r1 = max(int(np.floor(row - threshold / layout.dlat)), 0), min(int(np.ceil(row + threshold / layout.dlat)), rows - 1)
+        if c0 > c1 or r0 > r1:
+            return None
+        candidates = layout.cells[r0:r1 + 1, c0:c1 + 1]
+        candidates = candidates[candidates >= 0]
+        if len(candidates) == 0:
+            return None
+        distances = np.hypot(self.longitudes[candidates] - longitude, self.latitudes[candidates] - latitude)
+        best = distances.argmin()
+        if distances[best] <= threshold:
+            return int(candidates[best])
+        return None
+
+
+class GridCache:
+    """LRU of indexed grids keyed by `(product, date, mtime of the source file)`.
+
+    The least recently used grids are dropped once the grids in the cache take more
+    than `max_bytes`, but the most recent one is always kept. The last days of every
+    product stay loaded, so requests around the day boundary and the fallback to
+    yesterday's file don't go to the disk. A rewritten file is a new key, and loading
+    it drops the older version of its day.
+    """
+    def __init__(self, max_bytes: int = MAX_GRID_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._grids: OrderedDict[tuple[str, str, float | None], GridIndex] = OrderedDict()
+        self._loading: dict[tuple[str, str, float | None], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(grid.nbytes for grid in list(self._grids.values()))
+
+    def get(self, product: str, date: str, path: str) -> GridIndex:
+        """Return the grid of `product` for `date` built from the current version of the
+        GeoJSON at `path`, loading it on a miss. The file is converted to a snapshot the
+        first time a version is seen. Only one thread loads a version, lookups of other
+        grids go on meanwhile.
+        Raises `fiona.errors.DriverError` if neither the file nor its snapshot exist.
+        """
+        key = (product, date, os.path.getmtime(path) if os.path.exists(path) else None)
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                self.hits += 1
+                return grid
+            self.misses += 1
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                grid = self._grids.get(key)
+            if grid is not None:
+                return grid
+            try:
+                grid = GridIndex(open_snapshot(path))
+                with self._lock:
+                    for old in [old for old in self._grids if old[:2] == key[:2]]:
+                        self._grids.pop(old)
+                    self._grids[key] = grid
+                    size = self.nbytes
+                    while size > self.max_bytes and len(self._grids) > 1:
+                        _, evicted = self._grids.popitem(last=False)
+                        size -= evicted.nbytes
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        logger.info(f"loaded {product} {date} into the grid cache ({len(grid.snapshot)} points)")
+        return grid
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "grids": len(self._grids), "bytes": self.nbytes}
+
+
+grid_cache = GridCache()
+
+
+def load_grid(product: str, date: str, path: str) -> GridIndex:
+    """Return the indexed grid of `product` for `date` from the process's grid cache."""
+    return grid_cache.get(product, date, path)
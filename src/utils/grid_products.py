@@ -0,0 +1,147 @@
+import datetime
+import os
+import re
+
+from .grid_index import THRESHOLD, GridIndex
+from .grid_snapshot import DATA_DIR
+
+
+class GridChanged(Exception):
+    """Raised when a grid point is read from another version of a day's grid than the one
+    it was looked up in, e.g. while a rewritten file isn't published yet.
+    """
+
+
+class ActiveGrid:
+    """The validated, indexed day of a product that handlers currently read."""
+    def __init__(self, product: "GridProduct", date: str, grid: GridIndex, ready_at: datetime.datetime) -> None:
+        self.product = product
+        self.date = date
+        self.grid = grid
+        self.ready_at = ready_at
+
+    def lookup(self, longitude: float, latitude: float) -> "GridLookup | None":
+        """Return the data of the grid point closest to the location, or `None` if the
+        location is further than the product's threshold from every grid point.
+        """
+        idx = self.grid.nearest(longitude, latitude, self.product.threshold)
+        if idx is None:
+            return None
+        return GridLookup(self, idx)
+
+
+class GridLookup:
+    """One grid point of the active day, addressed through the product's variables."""
+    def __init__(self, active: ActiveGrid, idx: int) -> None:
+        self.product = active.product
+        self.date = active.date
+        self.idx = idx
+        self.snapshot = active.grid.snapshot
+
+    def series(self, variable: str) -> list:
+        """All time steps of `variable` in file order. For products aligned to today the
+        days that have already passed (when yesterday's file is active) are dropped.
+        """
+        skip = 0
+        if self.product.align_to_today:
+            skip = max((datetime.datetime.now() - datetime.datetime.strptime(self.date, "%Y%m%d")).days, 0)
+        return self.snapshot.series(self.product.variables[variable], self.idx, skip)
+
+    def days(self, variable: str, count: int) -> list:
+        """Values of `variable` for `count` days starting from the data date, or from today
+        for products aligned to today when an older file is active. Missing days are `None`.
+        """
+        prefix = self.product.variables[variable]
+        start = datetime.datetime.strptime(self.date, "%Y%m%d")
+        if self.product.align_to_today:
+            start = max(start, datetime.datetime.combine(datetime.date.today(), datetime.time()))
+        dates = [(start + datetime.timedelta(days=i)).strftime("%Y%m%d") for i in range(count)]
+        return [self.snapshot.value(prefix, date, self.idx) for date in dates]
+
+
+class GridProduct:
+    """A daily grid file published in `data/`.
+
+    Args:
+        name: Key of the product in the registry.
+        file_pattern: File name with a `{date}` (`%Y%m%d`) placeholder.
+        variables: Variable name -> prefix of its columns, e.g. `{"tmin": "tmin_Time="}`.
+        threshold: Maximum distance in degrees between a farm and its grid point.
+        max_age_days: How many days old the active file may be before the product is
+            reported as unavailable. 1 lets yesterday's file serve until today's arrives.
+        align_to_today: Drop the time steps of days that have passed when an older file is
+            active, `series` and `days` then start at today.
+    """
+    def __init__(
+        self,
+        name: str,
+        file_pattern: str,
+        variables: dict[str, str],
+        threshold: float = THRESHOLD,
+        max_age_days: int = 1,
+        align_to_today: bool = False,
+    ) -> None:
+        self.name = name
+        self.file_pattern = file_pattern
+        self.variables = variables
+        self.threshold = threshold
+        self.max_age_days = max_age_days
+        self.align_to_today = align_to_today
+        self.file_regex = re.compile("^" + re.escape(file_pattern).replace(r"\{date\}", r"(\d{8})") + "$")
+        self.active: ActiveGrid | None = None
+
+    def path(self, date: str, data_dir: str = DATA_DIR) -> str:
+        return os.path.join(data_dir, self.file_pattern.format(date=date))
+
+    def newest_file(self, data_dir: str = DATA_DIR) -> tuple[str, str] | None:
+        """Return `(date, path)` of the newest file of this product in `data_dir`."""
+        dates = [match.group(1) for match in map(self.file_regex.match, os.listdir(data_dir)) if match]
+        if not dates:
+            return None
+        date = max(dates)
+        return date, self.path(date, data_dir)
+
+    def validate(self, grid: GridIndex, date: str) -> None:
+        """Raise `ValueError` if `grid` isn't a complete file of this product for `date`."""
+        if len(grid.snapshot) == 0:
+            raise ValueError("grid has no points")
+        missing = [variable for variable, prefix in self.variables.items() if not grid.snapshot.has(prefix, date)]
+        if missing:
+            raise ValueError(f"grid has no {date} columns for {missing}")
+
+    def publish(self, date: str, grid: GridIndex, ready_at: datetime.datetime) -> None:
+        # a single attribute assignment, readers see either the old or the new day
+        self.active = ActiveGrid(self, date, grid, ready_at)
+
+    def current(self) -> ActiveGrid | None:
+        """Return the active day of this product or `None` if there is no recent enough file."""
+        active = self.active
+        if active is None:
+            return None
+        age = (datetime.datetime.now() - datetime.datetime.strptime(active.date, "%Y%m%d")).days
+        if age > self.max_age_days:
+            return None
+        return active
+
+
+GRID_PRODUCTS: dict[str, GridProduct] = {}
+
+
+def register_product(product: GridProduct) -> GridProduct:
+    GRID_PRODUCTS[product.name] = product
+    return product
+
+
+def get_product(name: str) -> GridProduct:
+    return GRID_PRODUCTS[name]
+
+
+register_product(GridProduct(
+    "weather", "Iran{date}_weather.geojson",
+    variables={"tmin": "tmin_Time=", "tmax": "tmax_Time=", "rh": "rh_Time=", "wind": "spd_Time=", "rain": "rain_Time="},
+    align_to_today=True,
+))
+register_product(GridProduct("sp", "Iran{date}_AdviseSP.geojson", variables={"advice": "Time="}))
+# the harvest advice is labelled with today's date, yesterday's file must be read from today's column
+register_product(GridProduct("harvest-pre", "pesteh{date}_Advise_Bef.geojson", variables={"advice": "Time="}, align_to_today=True))
+register_product(GridProduct("harvest-post", "pesteh{date}_Advise_Aft.geojson", variables={"advice": "Time="}, align_to_today=True))
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from .logger import logger
+
+DATA_DIR = "data"
+# point this to a tmpfs (e.g. /dev/shm/grid-snapshots) to keep the arrays in shared memory
+SNAPSHOT_DIR = os.environ.get("GRID_SNAPSHOT_DIR", os.path.join(DATA_DIR, "snapshots"))
+# days a snapshot is kept after its product's fallback window (max_age_days) has passed
+SNAPSHOT_KEEP_DAYS = int(os.environ.get("GRID_SNAPSHOT_KEEP_DAYS", 1))
+SNAPSHOT_FORMAT = 4
+# "tmin_Time=20240101" -> variable prefix "tmin_Time=", time step "20240101"
+COLUMN_PATTERN = re.compile(r"^(.*Time=)(\d{8})$")
+# A grid is treated as regular when every point lies within this fraction of a
+# cell of the lattice spanned by its smallest coordinate steps.
+REGULAR_TOLERANCE = 1e-3
+MAX_LATTICE_SIZE = 4  # lattice cells allowed per grid point, sparser grids use the tree
+
+
+class RegularLayout:
+    """Position of every point of a regular lon/lat grid in its lattice.
+
+    `cells[row, col]` is the point at `(lon0 + col * dlon, lat0 + row * dlat)` or -1
+    where the grid has no point (e.g. outside the country's border).
+    """
+    def __init__(self, lon0: float, lat0: float, dlon: float, dlat: float, cells: np.ndarray) -> None:
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.dlon = dlon
+        self.dlat = dlat
+        self.cells = cells
+
+    @classmethod
+    def detect(cls, longitudes: np.ndarray, latitudes: np.ndarray) -> "RegularLayout | None":
+        """Return the layout of the points, or `None` if they aren't on a regular lattice."""
+        if len(longitudes) < 2:
+            return None
+        axes = []
+        for values in (longitudes, latitudes):
+            unique = np.unique(values)
+            step = np.diff(unique).min() if len(unique) > 1 else 1.0
+            steps = (values - unique[0]) / step
+            positions = np.rint(steps)
+            if np.abs(steps - positions).max() > REGULAR_TOLERANCE:
+                return None
+            axes.append((unique[0], step, positions.astype(np.int64)))
+        (lon0, dlon, cols), (lat0, dlat, rows) = axes
+        shape = (rows.max() + 1, cols.max() + 1)
+        if shape[0] * shape[1] > MAX_LATTICE_SIZE * len(longitudes):
+            return None
+        cells = np.full(shape, -1, dtype=np.int32)
+        cells[rows, cols] = np.arange(len(longitudes), dtype=np.int32)
+        if np.count_nonzero(cells >= 0) != len(longitudes):
+            return None  # several points on one lattice cell
+        return cls(float(lon0), float(lat0), float(dlon), float(dlat), cells)
+
+
+class GridSnapshot:
+    """Read-only columnar copy of a grid GeoJSON.
+
+    Columns named `<prefix><date>` (e.g. `tmin_Time=20240101`, `Time=20240101`) are
+    grouped into one variable per prefix and stored as a `(cells, timesteps)` block,
+    so one farm's series is a single row slice. A snapshot directory holds:
+        lon.npy, lat.npy -> (cells,) float64
+        var<i>.npy       -> (cells, timesteps) float64, or int32 codes into meta["strings"]
+                            for text variables where -1 is null
+        cells.npy        -> lattice cell -> point table of regular grids, see `RegularLayout`
+        meta.json        -> variables with their block file, kind and time steps, the
+                            string table, the lattice, a hash of the points (grid_id)
+                            and the source file's mtime
+    All arrays are opened through memory mapping, so every process that opens a
+    snapshot shares one copy of it in the page cache.
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.grid_id: str = self.meta["grid_id"]  # equal for every snapshot with the same points
+        self.source_mtime: float | None = self.meta["source_mtime"]  # mtime of the GeoJSON it was built from
+        self.columns: list[str] = self.meta["columns"]
+        self.strings: list[str] = self.meta["strings"]
+        self.longitudes = np.load(os.path.join(directory, "lon.npy"), mmap_mode="r")
+        self.latitudes = np.load(os.path.join(directory, "lat.npy"), mmap_mode="r")
+        self.blocks: dict[str, np.ndarray] = {}
+        self.text_variables: set[str] = set()
+        # variable -> {time step -> column of its block}
+        self.time_index: dict[str, dict[str, int]] = {}
+        for prefix, variable in self.meta["variables"].items():
+            self.blocks[prefix] = np.load(os.path.join(directory, variable["file"]), mmap_mode="r")
+            self.time_index[prefix] = {time: i for i, time in enumerate(variable["times"])}
+            if variable["kind"] == "text":
+                self.text_variables.add(prefix)
+        self.layout: RegularLayout | None = None
+        lattice = self.meta.get("lattice")
+        if lattice is not None:
+            cells = np.load(os.path.join(directory, "cells.npy"), mmap_mode="r")
+            self.layout = RegularLayout(lattice["lon0"], lattice["lat0"], lattice["dlon"], lattice["dlat"], cells)
+
+    def __len__(self) -> int:
+        return len(self.longitudes)
+
+    @property
+    def nbytes(self) -> int:
+        size = self.longitudes.nbytes + self.latitudes.nbytes + sum(block.nbytes for block in self.blocks.values())
+        if self.layout is not None:
+            size += self.layout.cells.nbytes
+        return size
+
+    def has(self, prefix: str, time: str) -> bool:
+        return time in self.time_index.get(prefix, {})
+
+    def _decode(self, codes: np.ndarray) -> list[str | None]:
+        return [self.strings[code] if code >= 0 else None for code in codes.tolist()]
+
+    def series(self, prefix: str, idx: int, start: int = 0) -> list:
+        """All time steps of a variable at grid point `idx`, from the `start`th one on."""
+        values = self.blocks[prefix][idx, start:]
+        if prefix in self.text_variables:
+            return self._decode(values)
+        return values.tolist()
+
+    def value(self, prefix: str, time: str, idx: int):
+        """The value of a variable at one time step, `None` if the file has no such column."""
+        column = self.time_index.get(prefix, {}).get(time)
+        if column is None:
+            return None
+        value = self.blocks[prefix][idx, column]
+        if prefix in self.text_variables:
+            return self.strings[value] if value >= 0 else None
+        return float(value)
+
+
+def snapshot_path(geojson_path: str) -> str:
+    name = os.path.splitext(os.path.basename(geojson_path))[0]
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def snapshot_is_current(geojson_path: str) -> bool:
+    """True if a snapshot in the current format exists for `geojson_path` and was built
+    from its current version. A snapshot whose source file was removed is still considered current.
+    """
+    meta_path = os.path.join(snapshot_path(geojson_path), "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        return False
+    if not os.path.exists(geojson_path):
+        return True
+    return meta.get("source_mtime") == os.path.getmtime(geojson_path)
+
+
+def write_snapshot(geojson_path: str) -> str:
+    """Convert a grid GeoJSON to a snapshot directory and return its path.
+    Raises `fiona.errors.DriverError` if the file does not exist.
+    """
+    source_mtime = os.path.getmtime(geojson_path) if os.path.exists(geojson_path) else None
+    data = gpd.read_file(geojson_path)
+    columns = [column for column in data.columns if column != data.geometry.name]
+    # group the columns by variable, keeping the order of the file
+    variables: dict[str, list[tuple[str, str]]] = {}
+    for column in columns:
+        match = COLUMN_PATTERN.match(column)
+        prefix, time = (match.group(1), match.group(2)) if match else (column, "")
+        variables.setdefault(prefix, []).append((column, time))
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=SNAPSHOT_DIR)
+    longitudes = data.geometry.x.to_numpy(dtype=np.float64)
+    latitudes = data.geometry.y.to_numpy(dtype=np.float64)
+    np.save(os.path.join(tmp_dir, "lon.npy"), longitudes)
+    np.save(os.path.join(tmp_dir, "lat.npy"), latitudes)
+    grid_id = hashlib.sha1(longitudes.tobytes() + latitudes.tobytes()).hexdigest()[:16]
+    layout = RegularLayout.detect(longitudes, latitudes)
+    lattice = None
+    if layout is not None:
+        np.save(os.path.join(tmp_dir, "cells.npy"), layout.cells)
+        lattice = {"lon0": layout.lon0, "lat0": layout.lat0, "dlon": layout.dlon, "dlat": layout.dlat}
+
+    strings: list[str] = []
+    string_codes: dict[str, int] = {}
+    variables_meta = {}
+    for i, (prefix, variable_columns) in enumerate(variables.items()):
+        names = [column for column, _ in variable_columns]
+        if all(pd.api.types.is_numeric_dtype(data[column]) for column in names):
+            kind = "float"
+            block = data[names].to_numpy(dtype=np.float64)
+        else:
+            kind = "text"
+            block = np.full((len(data), len(names)), -1, dtype=np.int32)
+            for j, column in enumerate(names):
+                for k, value in enumerate(data[column]):
+                    if pd.isna(value):
+                        continue
+                    value = str(value)
+                    if value not in string_codes:
+                        string_codes[value] = len(strings)
+                        strings.append(value)
+                    block[k, j] = string_codes[value]
+        file_name = f"var{i}.npy"
+        np.save(os.path.join(tmp_dir, file_name), np.ascontiguousarray(block))
+        variables_meta[prefix] = {"file": file_name, "kind": kind, "times": [time for _, time in variable_columns]}
+
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "source": os.path.basename(geojson_path),
+        "source_mtime": source_mtime,
+        "grid_id": grid_id,
+        "columns": columns,
+        "variables": variables_meta,
+        "lattice": lattice,
+        "strings": strings,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    # Swap the new directory in. Processes that already mapped the old arrays keep
+    # reading them until they reopen the snapshot.
+    target = snapshot_path(geojson_path)
+    if os.path.exists(target):
+        old_dir = tempfile.mkdtemp(prefix=".old-", dir=SNAPSHOT_DIR)
+        os.replace(target, os.path.join(old_dir, "snapshot"))
+        os.replace(tmp_dir, target)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, target)
+    logger.info(f"wrote grid snapshot {target} ({len(data)} points, {len(columns)} columns)")
+    return target
+
+
+def open_snapshot(geojson_path: str) -> GridSnapshot:
+    """Open the snapshot of `geojson_path`, converting the GeoJSON first if needed."""
+    if not snapshot_is_current(geojson_path):
+        write_snapshot(geojson_path)
+    return GridSnapshot(snapshot_path(geojson_path))
@@ -1,8 +1,5 @@
-import datetime
 import jdatetime
-import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
 from telegram import Update
 from telegram.ext import (
     CommandHandler,
@@ -13,10 +10,13 @@ from telegram.ext import (
 )
 from telegram.error import Forbidden, BadRequest
 
-from fiona.errors import DriverError
 import warnings
 import database
 from .logger import logger
+from .grid_products import GridChanged, get_product
+from .farm_cells import farm_cell
+from .geo_pool import geo_pool, GeoPoolError, BUSY_MESSAGE
+from .geo_tasks import product_days
 from .keyboards import (
     farms_list_reply,
     view_advise_keyboard
@@ -105,10 +105,6 @@ async def recv_harvest_advice(update: Update, context: ContextTypes.DEFAULT_TYPE
                                  reply_markup=db.find_start_keyboard(user.id))
         return ConversationHandler.END
     
-    yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y%m%d")
-    today = datetime.datetime.now().strftime("%Y%m%d")
-    day2 = (datetime.datetime.now() + datetime.timedelta(days=1)).strftime("%Y%m%d")
-    day3 = (datetime.datetime.now() + datetime.timedelta(days=2)).strftime("%Y%m%d")
     jtoday = jdatetime.datetime.now().strftime("%Y/%m/%d")
     jday2 = (jdatetime.datetime.now() + jdatetime.timedelta(days=1)).strftime("%Y/%m/%d")
     jday3 = (jdatetime.datetime.now() + jdatetime.timedelta(days=2)).strftime("%Y/%m/%d")
@@ -123,41 +119,29 @@ async def recv_harvest_advice(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     jdates = [jtoday, jday2, jday3]
     advise_tags = ['امروز', 'فردا', 'پس فردا']
-    try:
-        if datetime.time(7, 0).strftime("%H%M") <= datetime.datetime.now().strftime("%H%M") < datetime.time(20, 30).strftime("%H%M"): 
-            if harvest_type == "PRE":
-                harvest_data = gpd.read_file(f"data/pesteh{today}_Advise_Bef.geojson")
-                advice = "پیش از برداشت"
-            elif harvest_type == "POST":
-                harvest_data = gpd.read_file(f"data/pesteh{today}_Advise_Aft.geojson")
-                advice = "پس از برداشت"
-            else:
-                db.log_activity(user.id, "error - harvest type not found", harvest_type)
-                await update.message.reply_text("عمیلات قبلی لغو شد. لطفا دوباره تلاش کنید.", reply_markup=db.find_start_keyboard(user.id))
-                return ConversationHandler.END
-        else:
-            if harvest_type == "PRE":
-                harvest_data = gpd.read_file(f"data/pesteh{yesterday}_Advise_Bef.geojson")
-                advice = "پیش از برداشت"
-            elif harvest_type == "POST":
-                harvest_data = gpd.read_file(f"data/pesteh{yesterday}_Advise_Aft.geojson")
-                advice = "پس از برداشت"
-            else:
-                db.log_activity(user.id, "error - harvest type not found", harvest_type)
-                await update.message.reply_text("عمیلات قبلی لغو شد. لطفا دوباره تلاش کنید.", reply_markup=db.find_start_keyboard(user.id))
-                return ConversationHandler.END
-    except DriverError:
+    if harvest_type == "PRE":
+        harvest = get_product("harvest-pre").current()
+        advice = "پیش از برداشت"
+    elif harvest_type == "POST":
+        harvest = get_product("harvest-post").current()
+        advice = "پس از برداشت"
+    else:
+        db.log_activity(user.id, "error - harvest type not found", harvest_type)
+        await update.message.reply_text("عمیلات قبلی لغو شد. لطفا دوباره تلاش کنید.", reply_markup=db.find_start_keyboard(user.id))
+        return ConversationHandler.END
+    if harvest is None:
         logger.info(f"{user.id} requested harvest advice. file was not found!")
         await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
         return ConversationHandler.END
-    threshold = 0.1  # degrees
-    point = Point(longitude, latitude)
-    idx_min_dist = harvest_data.geometry.distance(point).idxmin()
-    closest_coords = harvest_data.geometry.iloc[idx_min_dist].coords[0]
-    row = harvest_data.iloc[idx_min_dist]
+    cell = farm_cell(user.id, farm, user_farms[farm], harvest)
     
-    if point.distance(Point(closest_coords)) <= threshold:
-        advise_3days = [row[f'Time={today}'], row[f'Time={day2}'], row[f'Time={day3}']]
+    if cell is not None:
+        try:
+            days = await geo_pool.run(product_days, harvest.product.name, harvest.date, cell, harvest.grid.snapshot.grid_id, 3, share=True)
+        except (GeoPoolError, GridChanged):
+            await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+            return ConversationHandler.END
+        advise_3days = days["advice"]
         db.set_user_attribute(user.id, f"farms.{farm}.advise", {"today": advise_3days[0], "day2": advise_3days[1], "day3":advise_3days[2]})
         try:
             if pd.isna(advise_3days[0]):
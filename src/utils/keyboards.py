@@ -17,6 +17,7 @@ def stats_keyboard():
     [
         # InlineKeyboardButton("دانلود فایل اکسل", callback_data='excel_download'),
         InlineKeyboardButton("تعداد اعضای بدون تلفن", callback_data='no_phone_count'),
+        InlineKeyboardButton("آمار کش داده‌ها", callback_data='data_stats'),
     ],
     # [
     #     InlineKeyboardButton("پراکندگی لوکیشن اعضا", callback_data='html_map'),
@@ -0,0 +1,543 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.transform import Affine, rowcol
+from rasterio.windows import Window
+
+from . import raster_math
+from .logger import logger
+from .coverage import CoverageMask
+from .grid_snapshot import DATA_DIR
+
+# This module is imported by the geo worker processes, keep it free of database access.
+
+# the band stacks are large, keep this on disk even if the grid snapshots are on a tmpfs
+RASTER_SNAPSHOT_DIR = os.environ.get("RASTER_SNAPSHOT_DIR", os.path.join(DATA_DIR, "snapshots", "rasters"))
+STACK_FORMAT = 3
+# "stack" copies every raster into a memory mapped array, "window" reads tiles of
+# the GeoTIFFs for deployments that can't hold the rasters
+RASTER_BACKEND = os.environ.get("RASTER_BACKEND", "stack")
+RASTER_TILE_CACHE_BYTES = int(os.environ.get("RASTER_TILE_CACHE_MB", 64)) * 2**20
+# blocks of the tiled copies and tiles of the sampler. A block holds every band of a
+# pixel, smaller blocks make a pixel read decompress less (see benchmarks/raster_io.py)
+TILE_SIZE = 16
+TILED_DIR = os.path.join(RASTER_SNAPSHOT_DIR, "tiled")
+CHILLING_STACK = "Chilling"  # name of the tiled file holding every chilling method
+COVERAGE_DIR = os.path.join(RASTER_SNAPSHOT_DIR, "coverage")
+PUBLISHED_PATH = os.path.join(RASTER_SNAPSHOT_DIR, "published.json")
+
+CHILLING_METHODS = ['Chilling_Hours', 'Chilling_Hours_7', 'Dynamic', 'Utah']
+GDD_METHODS = ["GDD", "GDD2"]
+
+AUTOMN_TIME_TO_START_BAND_INDEX = {
+    "هفته اول - آبان": 0,
+    "هفته دوم - آبان": 0,
+    "هفته سوم - آبان": 3,
+    "هفته چهارم - آبان": 10,
+    "هفته اول - آذر": 24,
+    "هفته دوم - آذر": 31,
+    "هفته سوم - آذر": 38,
+    "هفته چهارم - آذر": 45,
+    "هفته اول آبان": 0,
+    "هفته دوم آبان": 0,
+    "هفته سوم آبان": 3,
+    "هفته چهارم آبان": 10,
+    "هفته اول آذر": 24,
+    "هفته دوم آذر": 31,
+    "هفته سوم آذر": 38,
+    "هفته چهارم آذر": 45,
+}
+
+
+# the autumn times the bot stores on farms, see `automn_conv.set_automn_time`
+AUTOMN_TIMES = [automn_time for automn_time in AUTOMN_TIME_TO_START_BAND_INDEX if " - " in automn_time]
+
+
+def raster_path(method: str) -> str:
+    return f"data/Daily_{method}.tif"
+
+
+def _file_version(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino
+
+
+_EMPTY_MANIFEST = {"format": None, "methods": {}, "retired": {}}
+_published: tuple[tuple[int, int] | None, dict] = (None, _EMPTY_MANIFEST)
+
+
+def published_manifest() -> dict:
+    """The versions of the rasters readers use, written by `raster_ingest` once every file
+    of a new version is in place: `{"format": STACK_FORMAT, "methods": {method: entry},
+    "retired": {method: entry}}`. An entry holds the source file's `mtime` and band count
+    and the names of its band `stack` directory, `tiled` copy (`{"file", "bands"}`) and
+    `coverage` mask. The stack or tiled copy is `None` when the backend doesn't use it.
+    """
+    global _published
+    version = _file_version(PUBLISHED_PATH)
+    if version != _published[0]:
+        try:
+            with open(PUBLISHED_PATH, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = _EMPTY_MANIFEST
+        _published = (version, manifest)
+    return _published[1]
+
+
+def published_raster(method: str) -> dict:
+    """The published entry of `method`'s raster.
+    Raises `rasterio.errors.RasterioIOError` if no version of it has been published.
+    """
+    entry = published_manifest()["methods"].get(method)
+    if entry is None:
+        raise RasterioIOError(f"no version of {raster_path(method)} has been published")
+    return entry
+
+
+def raster_versions(methods: list[str]) -> dict[str, float | None]:
+    """The source mtime of the published version of each method's raster, `None` if there is none."""
+    published = published_manifest()["methods"]
+    return {method: published[method]["mtime"] if method in published else None for method in methods}
+
+
+def raster_source(method: str) -> tuple[str, slice]:
+    """Return the published tiled copy of `method`'s raster and the slice of its bands that belong to it.
+    Raises `rasterio.errors.RasterioIOError` if no tiled copy has been published.
+    """
+    tiled = published_raster(method)["tiled"]
+    if tiled is None:
+        raise RasterioIOError(f"no tiled copy of {raster_path(method)} has been published")
+    return os.path.join(TILED_DIR, tiled["file"]), slice(*tiled["bands"])
+
+
+class RasterHandle:
+    """An open dataset and the `(mtime, inode)` of the file it was opened from."""
+    def __init__(self, path: str, version: tuple[int, int] | None, dataset: rasterio.DatasetReader) -> None:
+        self.path = path
+        self.version = version
+        self.dataset = dataset
+        self.lock = threading.Lock()
+
+
+class RasterPool:
+    """Open dataset handles, one per raster path.
+
+    A handle is reused until the file's mtime or inode changes (a rewrite in place or a
+    new file moved over it), then the file is reopened. Handles of removed files, like
+    the old versions of the tiled copies, are closed whenever a file is opened. GDAL
+    datasets can't be read from several threads at once, so reads go through `dataset`,
+    which holds the handle's lock.
+    """
+    def __init__(self) -> None:
+        self.opens = 0
+        self.reopens = 0
+        self._handles: dict[str, RasterHandle] = {}
+        self._lock = threading.Lock()
+
+    def _handle(self, path: str) -> RasterHandle:
+        version = _file_version(path)
+        handle = self._handles.get(path)
+        if handle is not None and handle.version == version:
+            return handle
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is not None and handle.version == version:
+                return handle
+            dataset = rasterio.open(path)
+            for other in [other for other in self._handles.values() if other.path != path and _file_version(other.path) is None]:
+                self._close(self._handles.pop(other.path))
+            if handle is None:
+                self.opens += 1
+            else:
+                self.reopens += 1
+                self._close(handle)
+            handle = self._handles[path] = RasterHandle(path, version, dataset)
+        return handle
+
+    @staticmethod
+    def _close(handle: RasterHandle) -> None:
+        with handle.lock:
+            handle.dataset.close()
+
+    @contextmanager
+    def dataset(self, path: str) -> Iterator[RasterHandle]:
+        """Yield the current handle of `path` with its lock held.
+        Raises `rasterio.errors.RasterioIOError` if the file can't be opened.
+        """
+        while True:
+            handle = self._handle(path)
+            with handle.lock:
+                # the handle may have been replaced while this thread waited for it
+                if not handle.dataset.closed:
+                    yield handle
+                    return
+
+    def stats(self) -> dict[str, int]:
+        return {"opens": self.opens, "reopens": self.reopens, "handles": len(self._handles)}
+
+
+raster_pool = RasterPool()
+
+
+def write_raster_coverage(method: str, transform: Affine, has_data: np.ndarray) -> str:
+    """Store the pixels of a version of `method`'s raster that have data (`has_data`,
+    `(rows, cols)`) and return the file's name in `COVERAGE_DIR`, see `raster_coverage`.
+    """
+    os.makedirs(COVERAGE_DIR, exist_ok=True)
+    name = f"{method}-{time.time_ns()}.npz"
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".npz", dir=COVERAGE_DIR)
+    with os.fdopen(fd, "wb") as f:
+        CoverageMask.from_raster(transform, has_data).save(f)
+    os.replace(tmp_path, os.path.join(COVERAGE_DIR, name))
+    return name
+
+
+_coverages: dict[str, tuple[str, CoverageMask]] = {}
+
+
+def raster_coverage(method: str) -> CoverageMask | None:
+    """The pixels of the published version of `method`'s raster that have data in any
+    band, `None` if no version has been published.
+    """
+    entry = published_manifest()["methods"].get(method)
+    if entry is None:
+        return None
+    cached = _coverages.get(method)
+    if cached is not None and cached[0] == entry["coverage"]:
+        return cached[1]
+    try:
+        mask, _ = CoverageMask.load(os.path.join(COVERAGE_DIR, entry["coverage"]))
+    except (OSError, ValueError, KeyError):
+        return None
+    _coverages[method] = (entry["coverage"], mask)
+    return mask
+
+
+class BandStack:
+    """All bands of a GeoTIFF as one memory mapped `(bands, rows, cols)` array.
+
+    A stack directory holds bands.npy and meta.json with the raster's transform and
+    the source file's mtime. Stacks of the chilling methods also hold suffix_sums.npy,
+    where `suffix_sums[i]` is the sum of bands `i` to the last one, skipping NaN bands,
+    summed in float64 and stored as float32, and the last plane is 0, so the hours
+    since any start band are a single read. Pixels without data in any band are NaN
+    in every plane.
+    """
+    def __init__(self, directory: str) -> None:
+        self.name = os.path.basename(directory)
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.transform = Affine(*self.meta["transform"])
+        self.source_mtime: float | None = self.meta["source_mtime"]
+        self.bands = np.load(os.path.join(directory, "bands.npy"), mmap_mode="r")
+        self.suffix_sums: np.ndarray | None = None
+        if self.meta["suffix_sums"]:
+            self.suffix_sums = np.load(os.path.join(directory, "suffix_sums.npy"), mmap_mode="r")
+
+    def _rowcol(self, longitude: float, latitude: float) -> tuple[int, int]:
+        row, col = rowcol(self.transform, longitude, latitude)
+        if row < 0 or col < 0:
+            raise IndexError(f"({longitude}, {latitude}) is outside the raster")
+        return row, col
+
+    def locate(self, longitudes: np.ndarray, latitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rows and columns of many locations and a mask of the ones inside the raster.
+        Locations outside get row and column 0.
+        """
+        rows, cols = rowcol(self.transform, longitudes, latitudes)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (cols >= 0) & (rows < self.bands.shape[1]) & (cols < self.bands.shape[2])
+        return np.where(inside, rows, 0), np.where(inside, cols, 0), inside
+
+    def pixel(self, longitude: float, latitude: float) -> np.ndarray:
+        """The value of every band at the location. Raises `IndexError` if the
+        location is outside the raster.
+        """
+        row, col = self._rowcol(longitude, latitude)
+        return self.bands[:, row, col]
+
+    def sum_from(self, start_band_index: int | None, longitude: float, latitude: float) -> float:
+        """Sum of the bands from `start_band_index` (0 if `None`) on at the location."""
+        row, col = self._rowcol(longitude, latitude)
+        start = min(start_band_index or 0, len(self.suffix_sums) - 1)
+        return float(self.suffix_sums[start, row, col])
+
+
+class BandStackWriter:
+    """Writes a version of `method`'s raster to a new stack directory window by window,
+    so the raster is never held in memory in full. The suffix sums are computed for the
+    chilling methods. Call `close` to move the finished stack in place or `abort` to drop it.
+    """
+    def __init__(self, method: str, count: int, height: int, width: int, dtype: str, transform: Affine, source_mtime: float) -> None:
+        self.method = method
+        self.transform = transform
+        self.source_mtime = source_mtime
+        os.makedirs(RASTER_SNAPSHOT_DIR, exist_ok=True)
+        self.tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=RASTER_SNAPSHOT_DIR)
+        self.bands = np.lib.format.open_memmap(os.path.join(self.tmp_dir, "bands.npy"), mode="w+", dtype=dtype, shape=(count, height, width))
+        self.suffix_sums = None
+        if method in CHILLING_METHODS:
+            self.suffix_sums = np.lib.format.open_memmap(
+                os.path.join(self.tmp_dir, "suffix_sums.npy"), mode="w+", dtype=np.float32, shape=(count + 1, height, width)
+            )
+
+    def write(self, window: Window, bands: np.ndarray) -> None:
+        """Write the `(bands, rows, cols)` values of the pixels in `window`."""
+        rows, cols = window.toslices()
+        self.bands[:, rows, cols] = bands
+        if self.suffix_sums is not None:
+            # reverse cumulative sum over the band axis, followed by a plane of zeros for
+            # start indices past the last band. float32 holds the sums of hourly counts
+            # (at most 24 per band) exactly enough
+            sums = np.zeros((bands.shape[0] + 1, *bands.shape[1:]), dtype=np.float32)
+            sums[:-1] = raster_math.nancumsum(bands, reverse=True)
+            sums[:, np.isnan(bands).all(axis=0)] = np.nan
+            self.suffix_sums[:, rows, cols] = sums
+
+    def close(self) -> str:
+        """Finish the stack and return its name in `RASTER_SNAPSHOT_DIR`."""
+        shape = self.bands.shape
+        for array in (self.bands, self.suffix_sums):
+            if array is not None:
+                array.flush()
+        self.bands = self.suffix_sums = None
+        meta = {
+            "format": STACK_FORMAT,
+            "source": os.path.basename(raster_path(self.method)),
+            "source_mtime": self.source_mtime,
+            "transform": list(self.transform)[:6],
+            "suffix_sums": self.method in CHILLING_METHODS,
+        }
+        with open(os.path.join(self.tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # a new directory per version, workers that still map the old one keep reading it
+        name = f"{self.method}-{time.time_ns()}"
+        os.replace(self.tmp_dir, os.path.join(RASTER_SNAPSHOT_DIR, name))
+        logger.info(f"wrote band stack {name} {shape}")
+        return name
+
+    def abort(self) -> None:
+        self.bands = self.suffix_sums = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+_stacks: dict[str, BandStack] = {}
+_stacks_lock = threading.Lock()
+
+
+def load_band_stack(method: str) -> BandStack:
+    """Return the band stack of the published version of `method`'s raster.
+    Raises `rasterio.errors.RasterioIOError` if no stack has been published.
+    """
+    name = published_raster(method)["stack"]
+    if name is None:
+        raise RasterioIOError(f"no band stack of {raster_path(method)} has been published")
+    stack = _stacks.get(method)
+    if stack is not None and stack.name == name:
+        return stack
+    with _stacks_lock:
+        stack = _stacks.get(method)
+        if stack is None or stack.name != name:
+            stack = _stacks[method] = BandStack(os.path.join(RASTER_SNAPSHOT_DIR, name))
+    return stack
+
+
+def warm_raster(method: str) -> None:
+    """Open the published version of `method`'s raster in this process and read it once,
+    so the first request after an update doesn't wait for the disk.
+    """
+    if RASTER_BACKEND == "window":
+        path, _ = raster_source(method)
+        with raster_pool.dataset(path):
+            pass
+        return
+    stack = load_band_stack(method)
+    stack.bands.sum(dtype=np.float64)
+    if stack.suffix_sums is not None:
+        stack.suffix_sums[0].sum()
+
+
+class StackSampler:
+    """Reads pixels from the memory mapped band stacks."""
+    def pixel(self, method: str, longitude: float, latitude: float) -> np.ndarray:
+        return load_band_stack(method).pixel(longitude, latitude)
+
+    def sum_from(self, method: str, start_band_index: int | None, longitude: float, latitude: float) -> float:
+        return load_band_stack(method).sum_from(start_band_index, longitude, latitude)
+
+
+class TileSampler:
+    """Reads pixels through `TILE_SIZE` x `TILE_SIZE` windows of all bands of the GeoTIFFs.
+
+    For rasters too large to copy. The published tiled copies written by `raster_ingest`
+    are read, so a tile is one compressed block of the file. The
+    recently read tiles are kept in an LRU limited to `max_bytes`. The files are read
+    through `raster_pool`.
+
+    Each geo worker has its own sampler and runs one task at a time, so the cache isn't
+    shared: two workers asking for the same tile both read it. Concurrent requests for
+    the same location are grouped before they reach the workers (`GeoPool.run` with
+    `share`). The geo pool gives each worker an equal share of `RASTER_TILE_CACHE_MB`,
+    see `geo_tasks.init_worker`.
+    """
+    def __init__(self, max_bytes: int = RASTER_TILE_CACHE_BYTES, tile_size: int = TILE_SIZE) -> None:
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        self.hits = 0
+        self.misses = 0
+        self._tiles: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._tiles_bytes = 0
+        self._lock = threading.Lock()
+
+    def _tile(self, key: tuple) -> np.ndarray:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+        path, _, tile_row, tile_col = key
+        row_off, col_off = tile_row * self.tile_size, tile_col * self.tile_size
+        with raster_pool.dataset(path) as handle:
+            src = handle.dataset
+            window = Window(col_off, row_off, min(self.tile_size, src.width - col_off), min(self.tile_size, src.height - row_off))
+            tile = src.read(window=window)
+        with self._lock:
+            if key in self._tiles:
+                return self._tiles[key]
+            self._tiles[key] = tile
+            self._tiles_bytes += tile.nbytes
+            while self._tiles_bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._tiles_bytes -= evicted.nbytes
+        return tile
+
+    def pixel(self, method: str, longitude: float, latitude: float) -> np.ndarray:
+        path, bands = raster_source(method)
+        with raster_pool.dataset(path) as handle:
+            version, src = handle.version, handle.dataset
+            row, col = rowcol(src.transform, longitude, latitude)
+            inside = 0 <= row < src.height and 0 <= col < src.width
+        if not inside:
+            raise IndexError(f"({longitude}, {latitude}) is outside the raster")
+        tile_row, tile_col = row // self.tile_size, col // self.tile_size
+        tile = self._tile((path, version, tile_row, tile_col))
+        return tile[bands, row - tile_row * self.tile_size, col - tile_col * self.tile_size]
+
+    def sum_from(self, method: str, start_band_index: int | None, longitude: float, latitude: float) -> float:
+        values = self.pixel(method, longitude, latitude)
+        # NaN only for pixels without data at all, like the suffix sums of the stacks
+        if np.isnan(raster_math.nansum(values, min_count=1)):
+            return float("nan")
+        return float(raster_math.nansum(values[start_band_index:]))
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "tiles": len(self._tiles), "bytes": self._tiles_bytes}
+
+
+sampler = TileSampler() if RASTER_BACKEND == "window" else StackSampler()
+
+
+def pixel_values(method: str, longitude: float, latitude: float) -> np.ndarray:
+    """Return the value of every band of `data/Daily_{method}.tif` at the location.
+    Raises `rasterio.errors.RasterioIOError` if the file is missing and `IndexError`
+    if the location is outside the raster.
+    """
+    return sampler.pixel(method, longitude, latitude)
+
+
+def calculate_chilling_hours(automn_time: str, longitude: float, latitude: float) -> dict[str, float]:
+    """Chilling hours since the autumn time's start band, days without data are skipped.
+    Raises `IndexError` if the location is outside the raster or has no data at all.
+    """
+    hours = {}
+    for method in CHILLING_METHODS:
+        start_band_index = AUTOMN_TIME_TO_START_BAND_INDEX.get(automn_time)
+        total = sampler.sum_from(method, start_band_index, longitude, latitude)
+        if np.isnan(total):
+            raise IndexError(f"({longitude}, {latitude}) has no data in {method}")
+        hours[method] = round(total)
+    return hours
+
+
+def calculate_gdd(longitude: float, latitude: float) -> dict[str, float]:
+    """GDD over every band, days without data are skipped.
+    Raises `IndexError` if the location is outside the raster or has no data at all.
+    """
+    hours = {}
+    for method in GDD_METHODS:
+        total = float(raster_math.nansum(pixel_values(method, longitude, latitude), min_count=1))
+        if np.isnan(total):
+            raise IndexError(f"({longitude}, {latitude}) has no data in {method}")
+        hours[method] = round(total)
+    return hours
+
+
+def _sampled_pixels(method: str, longitudes: np.ndarray, latitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """`(bands, locations)` values of many locations read one by one through the sampler,
+    for the window backend, and a mask of the locations inside the raster.
+    """
+    columns, inside = [], np.ones(len(longitudes), dtype=bool)
+    for i, (longitude, latitude) in enumerate(zip(longitudes, latitudes)):
+        try:
+            columns.append(sampler.pixel(method, float(longitude), float(latitude)))
+        except IndexError:
+            columns.append(None)
+            inside[i] = False
+    bands = next((len(column) for column in columns if column is not None), 0)
+    values = np.full((bands, len(columns)), np.nan)
+    for i, column in enumerate(columns):
+        if column is not None:
+            values[:, i] = column
+    return values, inside
+
+
+def batch_chilling_hours(longitudes: np.ndarray, latitudes: np.ndarray) -> dict[str, dict[str, np.ndarray]]:
+    """Chilling hours of many locations for every autumn time and method, read from
+    the band stacks in one pass per method (one by one with the window backend). NaN
+    for locations outside the rasters or without data.
+    """
+    hours = {automn_time: {} for automn_time in AUTOMN_TIMES}
+    for method in CHILLING_METHODS:
+        if RASTER_BACKEND == "window":
+            values, inside = _sampled_pixels(method, longitudes, latitudes)
+            suffix_sums = np.zeros((values.shape[0] + 1, values.shape[1]))
+            suffix_sums[:-1] = raster_math.nancumsum(values, reverse=True)
+            suffix_sums[:, np.isnan(values).all(axis=0)] = np.nan
+        else:
+            stack = load_band_stack(method)
+            rows, cols, inside = stack.locate(longitudes, latitudes)
+            suffix_sums = stack.suffix_sums[:, rows, cols]
+        for automn_time in AUTOMN_TIMES:
+            start = min(AUTOMN_TIME_TO_START_BAND_INDEX[automn_time], len(suffix_sums) - 1)
+            hours[automn_time][method] = np.where(inside, suffix_sums[start], np.nan)
+    return hours
+
+
+def batch_gdd(longitudes: np.ndarray, latitudes: np.ndarray) -> dict[str, np.ndarray]:
+    """GDD of many locations, NaN for locations outside the rasters or without data."""
+    hours = {}
+    for method in GDD_METHODS:
+        if RASTER_BACKEND == "window":
+            values, inside = _sampled_pixels(method, longitudes, latitudes)
+        else:
+            stack = load_band_stack(method)
+            rows, cols, inside = stack.locate(longitudes, latitudes)
+            values = stack.bands[:, rows, cols]
+        hours[method] = np.where(inside, raster_math.nansum(values, min_count=1), np.nan)
+    return hours
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Iterator
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from telegram.ext import ContextTypes
+
+from .logger import logger
+from .data_watcher import SETTLE_SECONDS
+from .geo_pool import GeoPoolBusy, geo_pool
+from .geo_tasks import warm_rasters
+from .raster_data import (
+    CHILLING_METHODS,
+    CHILLING_STACK,
+    COVERAGE_DIR,
+    GDD_METHODS,
+    PUBLISHED_PATH,
+    RASTER_BACKEND,
+    RASTER_SNAPSHOT_DIR,
+    STACK_FORMAT,
+    TILE_SIZE,
+    TILED_DIR,
+    BandStackWriter,
+    published_manifest,
+    raster_coverage,
+    raster_path,
+    write_raster_coverage,
+)
+
+# write the four chilling methods to one file, so a farm's chilling hours are one tile read
+RASTER_STACK_CHILLING = os.environ.get("RASTER_STACK_CHILLING", "0") == "1"
+# rows and columns of the windows rasters are copied in, multiples of TILE_SIZE so they
+# cover whole tiles of the tiled copies. Only one window of every band is in memory at a time
+INGEST_WINDOW = (4 * TILE_SIZE, 64 * TILE_SIZE)
+BUILD_TIMEOUT = 30 * 60  # seconds
+WARM_TIMEOUT = 5 * 60  # seconds
+
+_failed: dict[str, list[float]] = {}  # name -> source mtimes of a version that couldn't be ingested
+
+
+class RasterFile:
+    """A version of `data/Daily_{method}.tif`, opened and checked. Its bands are read
+    window by window through `read_windows`, which also fills `has_data`.
+    """
+    def __init__(self, method: str, mtime: float, dataset: rasterio.DatasetReader) -> None:
+        self.method = method
+        self.mtime = mtime
+        self.dataset = dataset
+        self.profile = dataset.profile
+        self.has_data = np.zeros((dataset.height, dataset.width), dtype=bool)
+
+    @property
+    def transform(self):
+        return self.profile["transform"]
+
+    @property
+    def count(self) -> int:
+        return self.profile["count"]
+
+
+def open_raster(method: str) -> RasterFile:
+    """Open `data/Daily_{method}.tif` and check its header.
+    Raises `ValueError` if it isn't a north up lon/lat grid, and rasterio's errors if it
+    can't be opened.
+    """
+    path = raster_path(method)
+    mtime = os.path.getmtime(path)
+    dataset = rasterio.open(path)
+    profile = dataset.profile
+    transform = profile["transform"]
+    try:
+        if profile["crs"] is None or not profile["crs"].is_geographic:
+            raise ValueError(f"{path} has CRS {profile['crs']}, expected longitude/latitude")
+        if transform.b != 0 or transform.d != 0 or transform.a <= 0 or transform.e >= 0:
+            raise ValueError(f"{path} isn't a north up grid: {tuple(transform)[:6]}")
+        if profile["count"] == 0:
+            raise ValueError(f"{path} has no bands")
+    except ValueError:
+        dataset.close()
+        raise
+    published = published_manifest()["methods"].get(method)
+    if published is not None and profile["count"] < published["bands"]:
+        logger.warning(f"{path} has {profile['count']} bands, the published version had {published['bands']}")
+    return RasterFile(method, mtime, dataset)
+
+
+def read_windows(rasters: list[RasterFile]) -> Iterator[tuple[Window, list[np.ndarray]]]:
+    """Every band of `rasters`, which share a grid, one window at a time, see
+    `INGEST_WINDOW`. Raises `ValueError` once all are read if a file changed
+    meanwhile or has no data, and rasterio's errors if one can't be read (e.g. it is truncated).
+    """
+    height, width = rasters[0].has_data.shape
+    window_rows, window_cols = INGEST_WINDOW
+    for row in range(0, height, window_rows):
+        for col in range(0, width, window_cols):
+            window = Window(col, row, min(window_cols, width - col), min(window_rows, height - row))
+            blocks = []
+            for raster in rasters:
+                block = raster.dataset.read(window=window)
+                raster.has_data[window.toslices()] = ~np.isnan(block).all(axis=0)
+                blocks.append(block)
+            yield window, blocks
+    for raster in rasters:
+        path = raster_path(raster.method)
+        if os.path.getmtime(path) != raster.mtime:
+            raise ValueError(f"{path} changed while it was read")
+        if not raster.has_data.any():
+            raise ValueError(f"{path} has no data")
+
+
+def write_tiled(name: str, rasters: list[RasterFile]) -> dict[str, dict]:
+    """Write the bands of `rasters`, one after the other, to one GeoTIFF with `TILE_SIZE`
+    pixel interleaved tiles and zstd compression. A pixel's values in every band are then
+    in one small block of the file. There are no overviews, the samplers only read full
+    resolution pixels. Returns `{method: {"file", "bands": [start, stop]}}`
+    with the file's name in `TILED_DIR`.
+    Raises `ValueError` if the rasters don't share a grid or can't be read, see `read_windows`.
+    """
+    profile = dict(rasters[0].profile)
+    for raster in rasters[1:]:
+        if (raster.profile["width"], raster.profile["height"], raster.transform) != (profile["width"], profile["height"], profile["transform"]):
+            raise ValueError(f"{raster_path(raster.method)} is not on the same grid as {raster_path(rasters[0].method)}")
+    floating = profile["dtype"].startswith("float")
+    profile.update(
+        driver="GTiff",
+        count=sum(raster.count for raster in rasters),
+        tiled=True,
+        blockxsize=TILE_SIZE,
+        blockysize=TILE_SIZE,
+        interleave="pixel",
+        compress="zstd",
+        predictor=3 if floating else 2,
+    )
+    os.makedirs(TILED_DIR, exist_ok=True)
+    # a new file name per version, readers that still have the old file open keep reading it
+    file_name = f"Daily_{name}-{time.time_ns()}.tif"
+    tmp_path = os.path.join(TILED_DIR, f".tmp-{file_name}")
+    sources = {}
+    try:
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            index = 1
+            for raster in rasters:
+                for i in range(raster.count):
+                    dst.set_band_description(index + i, f"{raster.method}:{i}")
+                sources[raster.method] = {"file": file_name, "bands": [index - 1, index - 1 + raster.count]}
+                index += raster.count
+            # every band of a window at once, each tile is compressed and written once
+            for window, blocks in read_windows(rasters):
+                dst.write(np.concatenate(blocks), window=window)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, os.path.join(TILED_DIR, file_name))
+    logger.info(f"wrote tiled raster {file_name} from {list(sources)}")
+    return sources
+
+
+def write_stack(raster: RasterFile) -> str:
+    """Write `raster` to a band stack and return the stack's name, see `raster_data.BandStack`."""
+    profile = raster.profile
+    writer = BandStackWriter(raster.method, raster.count, profile["height"], profile["width"], profile["dtype"], raster.transform, raster.mtime)
+    try:
+        for window, (block,) in read_windows([raster]):
+            writer.write(window, block)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def build_version(name: str, methods: list[str]) -> dict[str, dict]:
+    """Copy the current files of `methods` window by window to everything the readers of
+    the configured backend need, checking them on the way. Returns the entries to publish,
+    see `raster_data.published_manifest`. Submitted to the geo pool by `ingest_new_rasters`,
+    the bot process never reads the rasters.
+    """
+    rasters = []
+    try:
+        for method in methods:
+            rasters.append(open_raster(method))
+        if RASTER_BACKEND == "window":
+            tiled, stacks = write_tiled(name, rasters), {}
+        else:
+            tiled, stacks = {}, {raster.method: write_stack(raster) for raster in rasters}
+        return {
+            raster.method: {
+                "mtime": raster.mtime,
+                "bands": raster.count,
+                "stack": stacks.get(raster.method),
+                "tiled": tiled.get(raster.method),
+                "coverage": write_raster_coverage(raster.method, raster.transform, raster.has_data),
+            }
+            for raster in rasters
+        }
+    finally:
+        for raster in rasters:
+            raster.dataset.close()
+
+
+def publish_rasters(entries: dict[str, dict]) -> dict:
+    """Make `entries` the versions readers use with a single file replace and return the
+    new manifest. The versions they replace stay on disk until they are replaced
+    themselves, for readers that loaded the manifest just before.
+    """
+    manifest = published_manifest()
+    if manifest["format"] != STACK_FORMAT:
+        manifest = {"format": STACK_FORMAT, "methods": {}, "retired": {}}
+    retired = {method: manifest["methods"][method] for method in entries if method in manifest["methods"]}
+    manifest = {
+        "format": STACK_FORMAT,
+        "methods": {**manifest["methods"], **entries},
+        "retired": {**manifest["retired"], **retired},
+    }
+    os.makedirs(RASTER_SNAPSHOT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=RASTER_SNAPSHOT_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, PUBLISHED_PATH)
+    return manifest
+
+
+def remove_unpublished(manifest: dict) -> None:
+    """Remove the stacks, tiled copies and coverage masks that are neither published nor retired."""
+    keep = set()
+    for entry in list(manifest["methods"].values()) + list(manifest["retired"].values()):
+        keep.update(name for name in (entry["stack"], entry["coverage"]) if name)
+        if entry["tiled"]:
+            keep.add(entry["tiled"]["file"])
+    for directory in (RASTER_SNAPSHOT_DIR, TILED_DIR, COVERAGE_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            # dot files are still being written
+            if name.startswith(".") or name in keep or path in (PUBLISHED_PATH, TILED_DIR, COVERAGE_DIR):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+
+def due_rasters() -> list[tuple[str, list[str], list[float]]]:
+    """`(name, methods, source mtimes)` of every raster in `data/` that changed since its
+    published version. A file is only due once it has been left alone for `SETTLE_SECONDS`,
+    and a version that failed before is skipped, so readers keep the last good one.
+    """
+    if RASTER_STACK_CHILLING and RASTER_BACKEND == "window":
+        groups = [(CHILLING_STACK, CHILLING_METHODS)] + [(method, [method]) for method in GDD_METHODS]
+    else:
+        groups = [(method, [method]) for method in CHILLING_METHODS + GDD_METHODS]
+    manifest = published_manifest()
+    published = manifest["methods"] if manifest["format"] == STACK_FORMAT else {}
+    due = []
+    for name, methods in groups:
+        paths = [raster_path(method) for method in methods]
+        if not all(os.path.exists(path) for path in paths):
+            continue
+        if any(time.time() - os.path.getmtime(path) < SETTLE_SECONDS for path in paths):
+            continue
+        mtimes = [os.path.getmtime(path) for path in paths]
+        if _failed.get(name) == mtimes or all(published.get(method, {}).get("mtime") == mtime for method, mtime in zip(methods, mtimes)):
+            continue
+        due.append((name, methods, mtimes))
+    return due
+
+
+def _after_publish(manifest: dict) -> None:
+    remove_unpublished(manifest)
+    for method in CHILLING_METHODS + GDD_METHODS:
+        raster_coverage(method)
+
+
+async def ingest_new_rasters(context: ContextTypes.DEFAULT_TYPE) -> list[str]:
+    """Build a new version of every due raster in the geo pool and publish it, then warm
+    the geo workers up for them. Returns the names of the published rasters, see
+    `raster_results.ingest_rasters_job`.
+    """
+    loop = asyncio.get_event_loop()
+    written = []
+    manifest = None
+    for name, methods, mtimes in await loop.run_in_executor(None, due_rasters):
+        try:
+            entries = await geo_pool.run(build_version, name, methods, timeout=BUILD_TIMEOUT)
+        except GeoPoolBusy:
+            # tried again on the next run
+            continue
+        except Exception as e:
+            logger.error(f"couldn't ingest the raster {name}, keeping its published version: {e}")
+            _failed[name] = mtimes
+            continue
+        manifest = await loop.run_in_executor(None, publish_rasters, entries)
+        logger.info(f"published raster {name}")
+        written.append(name)
+    if not written:
+        return written
+    await loop.run_in_executor(None, _after_publish, manifest)
+    # one task per worker, the pool hands them to different workers while they're busy reading
+    results = await asyncio.gather(
+        *(geo_pool.run(warm_rasters, timeout=WARM_TIMEOUT) for _ in range(geo_pool.workers)),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"couldn't warm a geo worker up: {result}")
+    return written
@@ -0,0 +1,33 @@
+"""NaN aware accumulation over the band axis of raster time series.
+
+The functions take a single pixel's series `(bands,)`, many pixels `(bands, pixels)`
+or whole stacks `(bands, rows, cols)` and reduce along `axis` (the band axis, 0 by
+default) in float64. NaN bands (no data for that day) count as 0.
+"""
+import numpy as np
+
+
+def nansum(values: np.ndarray, axis: int = 0, min_count: int = 0) -> np.ndarray:
+    """Sum of the non-NaN values along `axis`. Where fewer than `min_count` values are
+    non-NaN the result is NaN, so `min_count=1` tells pixels without data apart from 0.
+    """
+    values = np.asarray(values)
+    valid = ~np.isnan(values)
+    total = np.where(valid, values, 0).sum(axis=axis, dtype=np.float64)
+    if min_count > 0:
+        total = np.where(valid.sum(axis=axis) >= min_count, total, np.nan)
+    return total
+
+
+def nancumsum(values: np.ndarray, axis: int = 0, reverse: bool = False) -> np.ndarray:
+    """Cumulative sum of the non-NaN values along `axis`. With `reverse` element `i` is
+    the sum from `i` to the end, i.e. the hours accumulated since band `i`.
+    """
+    values = np.asarray(values)
+    values = np.where(np.isnan(values), 0, values)
+    if reverse:
+        values = np.flip(values, axis=axis)
+    total = np.cumsum(values, axis=axis, dtype=np.float64)
+    if reverse:
+        total = np.flip(total, axis=axis)
+    return total
@@ -0,0 +1,96 @@
+import datetime
+import math
+
+from telegram.ext import ContextTypes
+
+import database
+from .logger import logger
+from .geo_pool import geo_pool, GeoPoolError
+from .geo_tasks import farms_raster_results
+from .raster_ingest import ingest_new_rasters
+from .raster_data import CHILLING_METHODS, GDD_METHODS, raster_versions
+
+RESULTS_TIMEOUT = 15 * 60  # seconds
+
+db = database.Database()
+
+
+async def ingest_rasters_job(context: ContextTypes.DEFAULT_TYPE):
+    """Repeating job that publishes new rasters and then recomputes the stored results, so
+    they match the published versions from the moment the handlers read them.
+    """
+    written = await ingest_new_rasters(context)
+    if written:
+        logger.info(f"recomputing the raster results for {written}")
+        # a separate job, this one keeps ingesting while the results are computed
+        context.job_queue.run_once(compute_raster_results, when=0)
+
+
+async def compute_raster_results(context: ContextTypes.DEFAULT_TYPE):
+    """Job, run after every raster publish and nightly, that reads the chilling hours of every autumn time and the GDD of every
+    located farm from the rasters and stores them in the raster results collection.
+    """
+    farms = db.get_farms_with_location()
+    if not farms:
+        return
+    try:
+        results = await geo_pool.run(
+            farms_raster_results,
+            [farm["location"]["longitude"] for farm in farms],
+            [farm["location"]["latitude"] for farm in farms],
+            timeout=RESULTS_TIMEOUT,
+        )
+    except (GeoPoolError, OSError) as e:
+        logger.error(f"couldn't compute the raster results: {e}")
+        return
+    now = datetime.datetime.now()
+    documents = []
+    for i, farm in enumerate(farms):
+        # farms outside the rasters or on missing pixels are left to the handlers
+        chilling = {
+            automn_time: {method: round(float(values[i])) for method, values in methods.items()}
+            for automn_time, methods in results["chilling"].items()
+            if not any(math.isnan(values[i]) for values in methods.values())
+        }
+        gdd = {method: round(float(values[i])) for method, values in results["gdd"].items() if not math.isnan(values[i])}
+        if not chilling and not gdd:
+            continue
+        documents.append({
+            "userID": farm["_id"],
+            "farm_name": farm["farm"],
+            "location": farm["location"],
+            "sources": results["sources"],
+            "chilling": chilling,
+            "gdd": gdd,
+            "timestamp": now,
+        })
+    db.save_raster_results(documents)
+    logger.info(f"stored raster results of {len(documents)}/{len(farms)} farms")
+
+
+def _stored_results(user_id: int, farm: str, farm_document: dict, methods: list[str]) -> dict | None:
+    """The farm's stored results if they were computed for its current location from
+    the current version of every method's raster."""
+    document = db.get_raster_results(user_id, farm)
+    if document is None or document.get("location") != farm_document.get("location"):
+        return None
+    for method, mtime in raster_versions(methods).items():
+        if mtime is not None and document["sources"].get(method) != mtime:
+            return None
+    return document
+
+
+def stored_chilling_hours(user_id: int, farm: str, farm_document: dict) -> dict[str, int] | None:
+    """Chilling hours of the farm for its autumn time, `None` if they have to be computed."""
+    document = _stored_results(user_id, farm, farm_document, CHILLING_METHODS)
+    if document is None:
+        return None
+    return document["chilling"].get(farm_document.get("automn-time"))
+
+
+def stored_gdd(user_id: int, farm: str, farm_document: dict) -> dict[str, int] | None:
+    """GDD of the farm, `None` if it has to be computed."""
+    document = _stored_results(user_id, farm, farm_document, GDD_METHODS)
+    if document is None or len(document["gdd"]) != len(GDD_METHODS):
+        return None
+    return document["gdd"]
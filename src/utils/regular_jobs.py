@@ -1,9 +1,6 @@
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden, TimedOut
 from telegram.ext import ContextTypes
-import geopandas as gpd
-from shapely import Point
-from fiona.errors import DriverError
 
 import os
 import datetime
@@ -15,6 +12,7 @@ from .logger import logger
 from .sms_funcs import missing_data_notification, sms_block
 from .weather_api import get_weather_report
 from .table_generator import weather_table
+from .data_watcher import wait_for_data
 
 
 db = database.Database()
@@ -48,6 +46,7 @@ message_no_location = """
 
 
 admin_list = db.get_admins()
+DATA_WAIT_SECONDS = 15 * 60
 
 async def register_reminder(context: ContextTypes.DEFAULT_TYPE):
     user_id = context.job.chat_id
@@ -127,9 +126,7 @@ async def send_todays_data(context: ContextTypes.DEFAULT_TYPE):
                     text=f"admin user {admin} has blocked the bot"
                 )
                 
-    try:         
-        weather_data = gpd.read_file(f"data/Iran{today}_weather.geojson")
-    except DriverError:
+    if not await wait_for_data("weather", today, timeout=DATA_WAIT_SECONDS):
         for admin in admin_list:
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
             await context.bot.send_message(
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable, Hashable
+
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from .logger import logger
+
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 256))  # rendered images
+
+
+class RenderedImage:
+    """A rendered PNG and the Telegram `file_id` of its first upload."""
+    def __init__(self, png: bytes) -> None:
+        self.png = png
+        self.file_id: str | None = None
+
+
+class RenderCache:
+    """LRU of rendered images keyed by everything they are rendered from.
+
+    After the first upload of an image its `file_id` is sent instead of the bytes,
+    so a cached image costs neither a render nor an upload. Requests for an image that
+    is still being rendered wait for that render instead of starting their own.
+    """
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._images: OrderedDict[Hashable, RenderedImage] = OrderedDict()
+        self._lock = threading.Lock()
+        self._rendering: dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable, render: Callable[[], Awaitable[bytes]]) -> RenderedImage:
+        """Return the image of `key`, awaiting `render()` for its PNG on a miss."""
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+            rendering = self._rendering.get(key)
+            if rendering is None:
+                self.misses += 1
+                rendering = self._rendering[key] = asyncio.ensure_future(render())
+                rendering.add_done_callback(partial(self._rendered, key))
+            else:
+                self.hits += 1
+        # shielded, a cancelled request doesn't cancel the render others wait for
+        png = await asyncio.shield(rendering)
+        with self._lock:
+            image = self._images.get(key)
+        return image if image is not None else RenderedImage(png)
+
+    def _rendered(self, key: Hashable, rendering: asyncio.Future) -> None:
+        """Cache the image of a finished render, even if the request that started it is gone."""
+        with self._lock:
+            del self._rendering[key]
+            if rendering.cancelled() or rendering.exception() is not None:
+                return
+            self._images[key] = RenderedImage(rendering.result())
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "images": len(self._images)}
+
+
+render_cache = RenderCache()
+
+
+def table_key(table: str, day: str, *inputs) -> tuple[str, str, str]:
+    """Cache key of `table` rendered from `inputs` on data day `day`. The inputs are
+    hashed, so farms with the same data share one image and its `file_id`.
+    """
+    return table, day, hashlib.sha256(repr(inputs).encode("utf-8")).hexdigest()
+
+
+async def send_cached_photo(bot: Bot, chat_id: int, key: Hashable, render: Callable[[], Awaitable[bytes]], **kwargs) -> Message:
+    """Send the image of `key` from `render_cache`, by `file_id` once it has been uploaded."""
+    image = await render_cache.get(key, render)
+    if image.file_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=image.file_id, **kwargs)
+        except BadRequest as e:
+            logger.info(f"cached file_id of {key} was rejected, uploading it again: {e}")
+            image.file_id = None
+    message = await bot.send_photo(chat_id=chat_id, photo=image.png, **kwargs)
+    image.file_id = message.photo[-1].file_id
+    return message
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import shutil
+import signal
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from . import table_painter
+from .logger import logger
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))  # tables rendered at once
+RENDER_MAX_PENDING = int(os.environ.get("RENDER_MAX_PENDING", 16))  # rendering and waiting tables
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 20))  # seconds
+WKHTMLTOIMAGE_PATH = os.environ.get("WKHTMLTOIMAGE_PATH", "")
+TABLE_RENDERER = os.environ.get("TABLE_RENDERER", "wkhtmltoimage")  # or "pillow" for the weather and frost tables
+
+
+class RendererError(Exception):
+    """Base class of the errors a handler gets instead of a rendered table."""
+
+
+class RendererBusy(RendererError):
+    """Raised when too many tables are already waiting to be rendered."""
+
+
+class RenderTimeout(RendererError):
+    """Raised when a table wasn't rendered within the timeout."""
+
+
+class TableRenderer:
+    """Renders tables to PNG without blocking the event loop, HTML tables with
+    `wkhtmltoimage` and, with `TABLE_RENDERER=pillow`, the weather and frost tables with
+    `table_painter`.
+
+    `wkhtmltoimage` can't be kept running between images, so every table is still one
+    process. The binary is looked up once instead of running `which`
+    for each image, the HTML goes in over stdin and the PNG comes back over stdout.
+    At most `workers` tables are rendered at once and at most `max_pending` wait for
+    them; a process that runs longer than `timeout` seconds is killed with its children.
+    """
+    def __init__(self, workers: int = RENDER_WORKERS, max_pending: int = RENDER_MAX_PENDING, timeout: float = RENDER_TIMEOUT) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.rendered = 0
+        self.failed = 0
+        self._binary: str | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._backend: str | None = None
+
+    @property
+    def binary(self) -> str:
+        """Path of `wkhtmltoimage`. Raises `OSError` if it isn't installed."""
+        if self._binary is None:
+            binary = WKHTMLTOIMAGE_PATH or shutil.which("wkhtmltoimage")
+            if not binary or not os.access(binary, os.X_OK):
+                raise OSError(f"wkhtmltoimage executable not found: {binary or 'not on PATH'}")
+            self._binary = binary
+        return self._binary
+
+    @staticmethod
+    def _arguments(options: dict) -> list[str]:
+        arguments = []
+        for key, value in options.items():
+            arguments.append(f"--{key}")
+            if value is not None:
+                arguments.append(str(value))
+        return arguments
+
+    @property
+    def backend(self) -> str:
+        """"pillow" if `TABLE_RENDERER` asks for it and `table_painter` can be used, else "wkhtmltoimage"."""
+        if self._backend is None:
+            self._backend = "wkhtmltoimage"
+            if TABLE_RENDERER == "pillow":
+                if table_painter.available():
+                    self._backend = "pillow"
+                else:
+                    logger.warning(f"Pillow can't draw the tables (libraqm or {table_painter.TABLE_FONT} is missing), using wkhtmltoimage")
+        return self._backend
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Wait for one of the `workers` slots, raising `RendererBusy` if `max_pending` tables are unfinished."""
+        if self.pending >= self.max_pending:
+            raise RendererBusy(f"{self.max_pending} tables are already being rendered")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self.pending -= 1
+
+    async def render(self, html: str, options: dict | None = None) -> bytes:
+        """Return the PNG of `html`. `options` are `wkhtmltoimage` options without the
+        leading dashes, `None` values for flags, e.g. `{"width": 600}`.
+        Raises `RendererBusy` if `max_pending` tables are unfinished, `RenderTimeout`
+        if rendering takes longer than `timeout` seconds and `RendererError` if
+        `wkhtmltoimage` fails.
+        """
+        command = [self.binary, "--quiet", *self._arguments({"format": "png", **(options or {})}), "-", "-"]
+        async with self._slot():
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+            try:
+                png, stderr = await asyncio.wait_for(process.communicate(html.encode("utf-8")), self.timeout)
+            except asyncio.TimeoutError:
+                # kill the whole group, a child holding the pipes would keep `wait` waiting
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                self.failed += 1
+                logger.warning(f"wkhtmltoimage didn't render a table within {self.timeout}s")
+                raise RenderTimeout(f"rendering took longer than {self.timeout}s")
+        if not png:
+            self.failed += 1
+            raise RendererError(f"wkhtmltoimage exited with {process.returncode}: {stderr.decode('utf-8', 'replace')[-500:]}")
+        self.rendered += 1
+        return png
+
+    async def paint(self, paint: Callable[..., bytes], *args) -> bytes:
+        """Return the PNG a `table_painter` function draws from `args`, in a thread and
+        with the same limits and errors as `render`. A painting that times out can't be
+        stopped, it finishes in the background.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._slot():
+            try:
+                png = await asyncio.wait_for(loop.run_in_executor(None, paint, *args), self.timeout)
+            except asyncio.TimeoutError:
+                self.failed += 1
+                logger.warning(f"Pillow didn't draw a table within {self.timeout}s")
+                raise RenderTimeout(f"painting took longer than {self.timeout}s")
+            except Exception as e:
+                self.failed += 1
+                raise RendererError(f"couldn't paint the table: {e}") from e
+        self.rendered += 1
+        return png
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "rendered": self.rendered, "failed": self.failed, "pending": self.pending}
+
+
+renderer = TableRenderer()
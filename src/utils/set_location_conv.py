@@ -20,6 +20,7 @@ import warnings
 
 import database
 from pg_sync import update_farm_in_postgres
+from .farm_cells import assign_cells
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -82,6 +83,7 @@ async def cq_handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     db.set_user_attribute(target_user, f"farms.{farm_name}.location.longitude", long)
     db.set_user_attribute(target_user, f"farms.{farm_name}.location.latitude", lat)
+    assign_cells(target_user, farm_name, long, lat)
     db.set_user_attribute(target_user, f"farms.{farm_name}.link-status", "Verified")
     
     phone_number = db.get_user_attribute(target_user, "phone-number")
@@ -225,6 +227,7 @@ https://goo.gl/maps/3Nx2zh3pevaz9vf16
             try:
                 db.set_user_attribute(int(user_id), f"farms.{user_data['farm_name'][i]}.location.latitude", float(result[i].group(1)))
                 db.set_user_attribute(int(user_id), f"farms.{user_data['farm_name'][i]}.location.longitude", float(result[i].group(2)))
+                assign_cells(int(user_id), user_data['farm_name'][i], float(result[i].group(2)), float(result[i].group(1)))
                 
                 phone_number = db.get_user_attribute(int(user_id), "phone-number")
                 if phone_number:
@@ -263,6 +266,7 @@ async def handle_lat_long(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data["lat"] = latitude
     db.set_user_attribute(int(user_data["target"][0]), f"farms.{user_data['farm_name']}.location.longitude", float(user_data["long"]))
     db.set_user_attribute(int(user_data["target"][0]), f"farms.{user_data['farm_name']}.location.latitude", float(user_data["lat"]))
+    assign_cells(int(user_data["target"][0]), user_data['farm_name'], float(user_data["long"]), float(user_data["lat"]))
     db.set_user_attribute(int(user_data["target"][0]), f"farms.{user_data['farm_name']}.link-status", "Verified")
     db.log_activity(user.id, "set a user's location", user_data["target"][0])    
     phone_number = db.get_user_attribute(int(user_data["target"][0]), "phone-number")
@@ -1,27 +1,13 @@
-from imgkit import from_string
 from typing import List
 from itertools import zip_longest
-import re
 import jdatetime as jdt
 from .logger import logger
+from . import table_painter
+from .table_rows import frost_cells, weather_rows
+from .renderer import renderer
 
-def weather_table(
-    days: List[str],
-    source: List[str],
-    tmin: List[float],
-    tmax: List[float],
-    rh: List[float],
-    wind_direction: List[float],
-    wind_speed: List[float],
-    rain_sum: List[float],
-    snow_sum: list[float],
-    precip_probability: List[float],
-    direct_comparisons: int,
-    output: str = "table.png",
-) -> None:
-    
-    rows = len(days)
-    style = """
+# the parts of the tables' HTML, with `format` bound once at import
+_WEATHER_HEAD = """
 <style type="text/css">
 .tg  {border-collapse:collapse;border-color:#001d87;border-spacing:0; width: 100%;}
 .tg td{background-color:#aabcfe;border-color:#aabcfe;border-style:solid;border-width:1px;color:#669;
@@ -33,9 +19,7 @@ tr.span-2 {border-bottom: #aabcfe;}
 td.date-cell {border-bottom: #000;}
 .tg .tg-qivn{border-color:inherit;font-family:Impact, Charcoal, sans-serif !important;text-align:center;vertical-align:top}
 .tg .tg-s7u5{border-color:inherit;font-family:Impact, Charcoal, sans-serif !important;text-align:center;vertical-align:middle}
-</style>"""
-
-    header = """
+</style>
 <table class="tg">
 <thead>
   <tr>
@@ -58,89 +42,140 @@ td.date-cell {border-bottom: #000;}
   </tr>
 </thead>
 <tbody>"""
-
-    ending = """
+_WEATHER_ROW = (
+    '<tr class="t-content {}">' + '\n    <td class="tg-qivn">{}</td>' * 9
+).format
+_WEATHER_DAY = """
+    <td class="tg-qivn date-cell" style="vertical-align:middle;">{}</td>
+  </tr>
+  """.format
+_WEATHER_DAY_SPAN = """
+    <td class="tg-qivn date-cell" style="vertical-align:middle;" rowspan="{}">{}</td>
+  </tr>
+  """.format
+_TABLE_END = """
 </tbody>
 </table>
 """
-    num_rows = len(tmin)
+_FROST_HEAD = """
+  <!DOCTYPE html>
+    <html lang="fa" dir="rtl">
+    <head>
+      <meta charset="UTF-8">
+      <meta name="viewport" content="width=device-width, initial-scale=1.0">
+      <title>Document</title>
+      <style>
+        * {
+          font-family:Impact, Charcoal, sans-serif !important;
+        }
+        table { 
+          width: 100%;
+          border-collapse: collapse;
+        }
+        th, td {
+          border: 1.5px solid black;
+          text-align: center;
+        }
+        .th-border {
+          border-left: 4px solid black;
+        }
+        .table-green, .table-green > th, .table-green > td {
+            background-color: #92f496;
+        }
+        .table-yellow, .table-yellow > th, .table-yellow > td {
+            background-color: #fff178 ;
+        }
+        .table-orange, .table-orange > th, .table-orange > td {
+            background-color: #ffc268 ;
+        }
+        .table-red, .table-red > th, .table-red > td {
+            background-color: #ff8178 ;
+        }
+        .messages {
+          padding-inline-start: 25px;
+        }
+        .message {
+          padding: 5px;
+          font-size: larger;
+        }
+      </style>
+    </head>
 
-    row = """<tr class="t-content {}">
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>
-    <td class="tg-qivn">{}</td>"""
-    
-    date_cell_span_2 = """
-    <td class="tg-qivn date-cell" style="vertical-align:middle;" rowspan="2">{}</td>
-  </tr>
+    <body>
+      <table class="table text-center">
+        <thead>
+          <tr>
+            <th rowspan="2" class="text-center th-border">ساعت</th>
+            <th colspan="2" class="text-center th-border">0-6</th>
+            <th colspan="2" class="text-center th-border">6-12</th>
+            <th colspan="2" class="text-center th-border">12-18</th>
+            <th colspan="2" class="text-center th-border">18-24</th>
+          </tr>
+          <tr>
+            <th class="text-center">احتمال </br> سرمازدگی</th>
+            <th class="th-border text-center">وضعیت </br> باد</th>
+            <th class="text-center">احتمال </br> سرمازدگی</th>
+            <th class="th-border text-center">وضعیت </br> باد</th>
+            <th class="text-center">احتمال </br> سرمازدگی</th>
+            <th class="th-border text-center">وضعیت </br> باد</th>
+            <th class="text-center">احتمال </br> سرمازدگی</th>
+            <th class="th-border text-center">وضعیت </br> باد</th>
+          </tr>
+        </thead>
+          <tbody>
   """
-    date_cell = """
-    <td class="tg-qivn date-cell" style="vertical-align:middle;">{}</td>
-  </tr>
+_FROST_END = """
+          </tbody>
+      </table>
+      <div class="messages"></div>
+    </body>
+  </html>
   """
-    rows = ""
-    compare = 0
-    for i in range(num_rows):
-      if not all([tmin[i] == "--", tmax[i] == "--", rh[i] == "--", wind_direction[i] == "--", wind_speed[i] == "--", rain_sum[i] == "--", snow_sum[i] == "--", precip_probability[i] == "--"]):
-        if compare < direct_comparisons:
-          if i % 2 == 0:
-            rows = rows + row.format('span-2', rh[i], precip_probability[i], rain_sum[i], snow_sum[i], wind_speed[i], wind_direction[i], tmin[i], tmax[i], source[i]) + date_cell_span_2.format(days[i])
-            
-            compare += 1
-          else:
-            rows = rows + row.format('', rh[i], precip_probability[i], rain_sum[i], snow_sum[i], wind_speed[i], wind_direction[i], tmin[i], tmax[i], source[i]) + "</tr>"
-            
-        else:
-          rows = rows + row.format('', rh[i], precip_probability[i], rain_sum[i], snow_sum[i], wind_speed[i], wind_direction[i], tmin[i], tmax[i], source[i]) + date_cell.format(days[i])
-          
-    ## This is the old code that was used to generate the table without OpenMeteoWeather data
-    # for i in range(num_rows):
-    #   if not all([tmin[i] == "--", tmax[i] == "--", rh[i] == "--", wind_direction[i] == "--", wind_speed[i] == "--", rain_sum[i] == "--", rain_probability[i] == "--"]): 
-    #     rows = rows + row.format(rh[i], rain_probability[i], rain_sum[i], wind_speed[i], wind_direction[i], tmin[i], tmax[i], source[i], days[i])
-
-    html = style + header + rows + ending
+_FROST_ROW = "<tr><th scope='row' class='th-border'>{}</th>{}</tr>".format
+_FROST_CELLS = "<td class='table-{1}'>{0}</td><td class='th-border'>{2}</td>".format
 
-    # Split the HTML into lines
-    lines = html.split('\n')
 
-    # Use a set to keep track of seen contents
-    seen = set()
-
-    # Initialize an empty string to store the new HTML
-    new_html = ""
-
-    for line in lines:
-        # Extract the contents of the td element
-        match = re.search(r'<td class="tg-qivn date-cell" style="vertical-align:middle;"( rowspan="2")?>(.*?)</td>', line)
-        if match:
-            contents = match.group(2)
-            # If we've seen this content before and this td doesn't have rowspan="2", skip it
-            if contents in seen and match.group(1) is None:
-                continue
-            # Otherwise, add it to the set of seen contents
-            seen.add(contents)
-        # Add the line to the new HTML
-        new_html += line + '\n'
+async def weather_table(
+    days: List[str],
+    source: List[str],
+    tmin: List[float],
+    tmax: List[float],
+    rh: List[float],
+    wind_direction: List[float],
+    wind_speed: List[float],
+    rain_sum: List[float],
+    snow_sum: list[float],
+    precip_probability: List[float],
+    direct_comparisons: int,
+) -> bytes:
+    if renderer.backend == "pillow":
+        return await renderer.paint(
+            table_painter.weather_table,
+            days, source, tmin, tmax, rh, wind_direction, wind_speed, rain_sum, snow_sum, precip_probability, direct_comparisons,
+        )
+    
+    # the row plan already has the day cells' rowspans, duplicates of a day aren't emitted at all
+    parts = [_WEATHER_HEAD]
+    for values, day, day_rows in weather_rows(days, source, tmin, tmax, rh, wind_direction, wind_speed, rain_sum, snow_sum, precip_probability, direct_comparisons):
+        parts.append(_WEATHER_ROW("span-2" if day_rows > 1 else "", *values))
+        if day is None:
+            parts.append("</tr>")
+        elif day_rows == 1:
+            parts.append(_WEATHER_DAY(day))
+        else:
+            parts.append(_WEATHER_DAY_SPAN(day_rows, day))
+    parts.append(_TABLE_END)
+    html = "".join(parts)
 
-    # Now new_html contains the HTML with duplicate lines removed
-    # with open("table.html", "w") as f:
-    #     f.write(new_html)
     options = {"width": 1400}
-    from_string(new_html, output, options=options)
+    return await renderer.render(html, options)
 
 
-def chilling_hours_table(
+async def chilling_hours_table(
     methods: List[str],
     dates: List[str],
     hours: List[float],
-    output: str = "table.png",
-) -> None:
+) -> bytes:
     if not len(methods) == len(dates) == len(hours):
         raise ValueError(f"""
 All lists must be the same length.
@@ -183,22 +218,19 @@ hours: {len(hours)} {hours}
     <td class="tg-qivn method">{}</td>
   </tr>"""
 
-    rows = ""
-    for i in range(num_rows):
-        rows = rows + row.format(hours[i], dates[i], methods[i])
+    rows = "".join(row.format(hours[i], dates[i], methods[i]) for i in range(num_rows))
 
     html = style + header + rows + ending
 
     options = {"width": 600}
-    from_string(html, output, options=options)
+    return await renderer.render(html, options)
 
-def remaining_chilling_hours_table(
+async def remaining_chilling_hours_table(
     pesteh_types: List[str],
     complete_hours: List[float],
     hours_difference: List[float],
     hours: int,
-    output: str = "table.png",
-) -> None:
+) -> bytes:
     date = (jdt.date.today() - jdt.timedelta(days=1 )).strftime("%Y/%m/%d")
     style = """
 <style type="text/css">
@@ -253,152 +285,31 @@ def remaining_chilling_hours_table(
       <td class="right-column">{}</td>
     </tr>"""
 
-    rows = ""
-    for i in range(num_rows):
-      if hours_difference[i] < 0:
-        rows = rows + row_red.format(hours_difference[i], complete_hours[i], pesteh_types[i])
-      else:
-        rows = rows + row_green.format(hours_difference[i], complete_hours[i], pesteh_types[i])
+    rows = "".join(
+        (row_red if hours_difference[i] < 0 else row_green).format(hours_difference[i], complete_hours[i], pesteh_types[i])
+        for i in range(num_rows)
+    )
     
     html = style + header + rows + ending
     # with open("table2.html", "w") as file:
     #   file.write(html)
     options = {"width": 1600}
-    from_string(html, output, options=options)
+    return await renderer.render(html, options)
 
-def spring_frost_table(frost_advice: zip, messages: list[str], output = "frost-table.png"):
-  head = """
-  <!DOCTYPE html>
-    <html lang="fa" dir="rtl">
-    <head>
-      <meta charset="UTF-8">
-      <meta name="viewport" content="width=device-width, initial-scale=1.0">
-      <title>Document</title>
-      <style>
-        * {
-          font-family:Impact, Charcoal, sans-serif !important;
-        }
-        table { 
-          width: 100%;
-          border-collapse: collapse;
-        }
-        th, td {
-          border: 1.5px solid black;
-          text-align: center;
-        }
-        .th-border {
-          border-left: 4px solid black;
-        }
-        .table-green, .table-green > th, .table-green > td {
-            background-color: #92f496;
-        }
-        .table-yellow, .table-yellow > th, .table-yellow > td {
-            background-color: #fff178 ;
-        }
-        .table-orange, .table-orange > th, .table-orange > td {
-            background-color: #ffc268 ;
-        }
-        .table-red, .table-red > th, .table-red > td {
-            background-color: #ff8178 ;
-        }
-        .messages {
-          padding-inline-start: 25px;
-        }
-        .message {
-          padding: 5px;
-          font-size: larger;
-        }
-      </style>
-    </head>
-  """
-  thead = """
-    <body>
-      <table class="table text-center">
-        <thead>
-          <tr>
-            <th rowspan="2" class="text-center th-border">ساعت</th>
-            <th colspan="2" class="text-center th-border">0-6</th>
-            <th colspan="2" class="text-center th-border">6-12</th>
-            <th colspan="2" class="text-center th-border">12-18</th>
-            <th colspan="2" class="text-center th-border">18-24</th>
-          </tr>
-          <tr>
-            <th class="text-center">احتمال </br> سرمازدگی</th>
-            <th class="th-border text-center">وضعیت </br> باد</th>
-            <th class="text-center">احتمال </br> سرمازدگی</th>
-            <th class="th-border text-center">وضعیت </br> باد</th>
-            <th class="text-center">احتمال </br> سرمازدگی</th>
-            <th class="th-border text-center">وضعیت </br> باد</th>
-            <th class="text-center">احتمال </br> سرمازدگی</th>
-            <th class="th-border text-center">وضعیت </br> باد</th>
-          </tr>
-        </thead>
-          <tbody>
-  """
-  row = """
-  <tr>
-  <th scope="row" class="th-border">{{ label }}</th>
-  <td {% if temp1 == 0 %} class="table-green" {% elif temp1 == 1 %} class="table-yellow" {% elif temp1 == 2 %} class="table-orange" {% elif temp1 == 3 %} class="table-red" {% endif %}>{% if temp1 == 0 %} نداریم {% elif temp1 == 1 %} کم {% elif temp1 == 2 %} زیاد {% elif temp1 == 3 %} بسیار شدید {% endif %}</td>
-  <td class="th-border">{% if wind1 == 0 %} مناسب {% elif wind1 == 1 %} با احتیاط {% elif wind1 == 2 %} نامناسب {% endif %}</td>
-  <td {% if temp2 == 0 %} class="table-green" {% elif temp2 == 1 %} class="table-yellow" {% elif temp2 == 2 %} class="table-orange" {% elif temp2 == 3 %} class="table-red" {% endif %}>{% if temp2 == 0 %} نداریم {% elif temp2 == 1 %} کم {% elif temp2 == 2 %} زیاد {% elif temp2 == 3 %} بسیار شدید {% endif %}</td>
-  <td class="th-border">{% if wind2 == 0 %} مناسب {% elif wind2 == 1 %} با احتیاط {% elif wind2 == 2 %} نامناسب {% endif %}</td>
-  <td {% if temp3 == 0 %} class="table-green" {% elif temp3 == 1 %} class="table-yellow" {% elif temp3 == 2 %} class="table-orange" {% elif temp3 == 3 %} class="table-red" {% endif %}>{% if temp3 == 0 %} نداریم {% elif temp3 == 1 %} کم {% elif temp3 == 2 %} زیاد {% elif temp3 == 3 %} بسیار شدید {% endif %}</td>
-  <td class="th-border">{% if wind3 == 0 %} مناسب {% elif wind3 == 1 %} با احتیاط {% elif wind3 == 2 %} نامناسب {% endif %}</td>
-  <td {% if temp4 == 0 %} class="table-green" {% elif temp4 == 1 %} class="table-yellow" {% elif temp4 == 2 %} class="table-orange" {% elif temp4 == 3 %} class="table-red" {% endif %}>{% if temp4 == 0 %} نداریم {% elif temp4 == 1 %} کم {% elif temp4 == 2 %} زیاد {% elif temp4 == 3 %} بسیار شدید {% endif %}</td>
-  <td class="th-border">{% if wind4 == 0 %} مناسب {% elif wind4 == 1 %} با احتیاط {% elif wind4 == 2 %} نامناسب {% endif %}</td>
-  </tr>
-  """
-  end = """
-          </tbody>
-      </table>
-      <div class="messages">{}</div>
-    </body>
-  </html>
-  """
-  rows = ""
-  for label, temp1, wind1, temp2, wind2, temp3, wind3, temp4, wind4 in frost_advice:
-    row = "<tr>"
-    row += f"<th scope='row' class='th-border'>{label}</th>"
-    row += "<td class='table-green'>نداریم</td>" if temp1 == 0 else \
-           "<td class='table-yellow'>کم</td>" if temp1 == 1 else \
-           "<td class='table-orange'>زیاد</td>" if temp1 == 2 else \
-           "<td class='table-red'>بسیار شدید</td>"
-    row += "<td class='th-border'>--</td>" if temp1 == 0 else \
-           "<td class='th-border'>مناسب</td>" if wind1 == 0 else \
-           "<td class='th-border'>با احتیاط</td>" if wind1 == 1 else \
-           "<td class='th-border'>نامناسب</td>"
-    row += "<td class='table-green'>نداریم</td>" if temp2 == 0 else \
-           "<td class='table-yellow'>کم</td>" if temp2 == 1 else \
-           "<td class='table-orange'>زیاد</td>" if temp2 == 2 else \
-           "<td class='table-red'>بسیار شدید</td>"
-    row += "<td class='th-border'>--</td>" if temp2 == 0 else \
-           "<td class='th-border'>مناسب</td>" if wind2 == 0 else \
-           "<td class='th-border'>با احتیاط</td>" if wind2 == 1 else \
-           "<td class='th-border'>نامناسب</td>"
-    row += "<td class='table-green'>نداریم</td>" if temp3 == 0 else \
-           "<td class='table-yellow'>کم</td>" if temp3 == 1 else \
-           "<td class='table-orange'>زیاد</td>" if temp3 == 2 else \
-           "<td class='table-red'>بسیار شدید</td>"
-    row += "<td class='th-border'>--</td>" if temp3 == 0 else \
-           "<td class='th-border'>مناسب</td>" if wind3 == 0 else \
-           "<td class='th-border'>با احتیاط</td>" if wind3 == 1 else \
-           "<td class='th-border'>نامناسب</td>"
-    row += "<td class='table-green'>نداریم</td>" if temp4 == 0 else \
-           "<td class='table-yellow'>کم</td>" if temp4 == 1 else \
-           "<td class='table-orange'>زیاد</td>" if temp4 == 2 else \
-           "<td class='table-red'>بسیار شدید</td>"
-    row += "<td class='th-border'>--</td>" if temp4 == 0 else \
-           "<td class='th-border'>مناسب</td>" if wind4 == 0 else \
-           "<td class='th-border'>با احتیاط</td>" if wind4 == 1 else \
-           "<td class='th-border'>نامناسب</td>"
-    row += "</tr>"
-    rows = rows + row 
+
+async def spring_frost_table(frost_advice: zip, messages: list[str]) -> bytes:
+  if renderer.backend == "pillow":
+    return await renderer.paint(table_painter.spring_frost_table, list(frost_advice), messages)
+  parts = [_FROST_HEAD]
+  for label, *advice in frost_advice:
+    cells = []
+    for temp, wind in zip(advice[::2], advice[1::2]):
+      (frost, level), wind_text = frost_cells(temp, wind)
+      cells.append(_FROST_CELLS(frost, level, wind_text))
+    parts.append(_FROST_ROW(label, "".join(cells)))
   # if messages: 
   #   message_list = [f"<p class='message'>{message}</p>" for message in messages]
-  #   html = head + thead + rows + end.format("\n".join(message_list))
-  # else:
-  html = head + thead + rows + end.format("")
-  # with open("frost-table.html", "w") as file:
-  #     file.write(html)
+  parts.append(_FROST_END)
+  html = "".join(parts)
   options = {}
-  from_string(html, output, options=options)
\ No newline at end of file
+  return await renderer.render(html, options)
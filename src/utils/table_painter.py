@@ -0,0 +1,171 @@
+import io
+import os
+from functools import lru_cache
+from typing import List
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+from .table_rows import frost_cells, weather_rows
+
+# fonts with Persian glyphs, fonts-dejavu-core in the docker image
+TABLE_FONT = os.environ.get("TABLE_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+TABLE_FONT_BOLD = os.environ.get("TABLE_FONT_BOLD", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+MARGIN = 8  # pixels around the table, like the page margin of wkhtmltoimage
+
+# the colours of the table-{level} classes of the HTML frost table
+FROST_COLOURS = {"green": "#92f496", "yellow": "#fff178", "orange": "#ffc268", "red": "#ff8178"}
+
+
+def available() -> bool:
+    """Whether Pillow can shape Persian text, which needs libraqm, and the fonts exist."""
+    return features.check("raqm") and os.path.exists(TABLE_FONT) and os.path.exists(TABLE_FONT_BOLD)
+
+
+@lru_cache(maxsize=None)
+def _font(bold: bool, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(TABLE_FONT_BOLD if bold else TABLE_FONT, size)
+
+
+class Cell:
+    """A cell at `row`, `col` of a table grid. Lines of `text` are separated by `\\n`."""
+    def __init__(
+        self,
+        row: int,
+        col: int,
+        text,
+        rowspan: int = 1,
+        colspan: int = 1,
+        fill: str = "#ffffff",
+        color: str = "#000000",
+        size: int = 16,
+        bold: bool = False,
+        left_border: int = 0,
+    ) -> None:
+        self.row = row
+        self.col = col
+        self.lines = str(text).split("\n")
+        self.rowspan = rowspan
+        self.colspan = colspan
+        self.fill = fill
+        self.color = color
+        self.font = _font(bold, size)
+        self.left_border = left_border
+
+
+def _grow(sizes: list[int], start: int, span: int, needed: int) -> None:
+    """Spread what `needed` lacks over `sizes[start:start + span]`."""
+    missing = needed - sum(sizes[start:start + span])
+    if missing <= 0:
+        return
+    for i in range(span):
+        sizes[start + i] += missing // span + (1 if i < missing % span else 0)
+
+
+def paint_table(
+    cells: list[Cell],
+    width: int,
+    border: int = 1,
+    border_color: str = "#000000",
+    padding: tuple[int, int] = (1, 1),
+    direction: str = "ltr",
+) -> bytes:
+    """Draw `cells` as a table `width` pixels wide, like an HTML table with `width:100%` and
+    collapsed borders, and return it as PNG. Columns are laid out right to left when
+    `direction` is "rtl".
+    """
+    n_rows = max(cell.row + cell.rowspan for cell in cells)
+    n_cols = max(cell.col + cell.colspan for cell in cells)
+    pad_x, pad_y = padding
+    sizes = {}
+    for cell in cells:
+        ascent, descent = cell.font.getmetrics()
+        text_width = max(cell.font.getlength(line, direction=direction) for line in cell.lines)
+        sizes[cell] = (int(text_width) + 1 + 2 * pad_x + border, (ascent + descent) * len(cell.lines) + 2 * pad_y + border)
+
+    col_widths = [0] * n_cols
+    row_heights = [0] * n_rows
+    # single cells first, spanning cells only widen what their columns already need
+    for cell in sorted(cells, key=lambda cell: cell.colspan):
+        _grow(col_widths, cell.col, cell.colspan, sizes[cell][0])
+    for cell in sorted(cells, key=lambda cell: cell.rowspan):
+        _grow(row_heights, cell.row, cell.rowspan, sizes[cell][1])
+    table_width = max(width - 2 * MARGIN, sum(col_widths))
+    extra = table_width - sum(col_widths)
+    natural = sum(col_widths)
+    col_widths = [w + extra * w // natural for w in col_widths]
+    col_widths[-1] += table_width - sum(col_widths)
+
+    col_x = [MARGIN + sum(col_widths[:i]) for i in range(n_cols)]
+    row_y = [MARGIN + sum(row_heights[:i]) for i in range(n_rows)]
+    image = Image.new("RGB", (table_width + 2 * MARGIN, sum(row_heights) + 2 * MARGIN), "#ffffff")
+    draw = ImageDraw.Draw(image)
+    for cell in cells:
+        cell_width = sum(col_widths[cell.col:cell.col + cell.colspan])
+        cell_height = sum(row_heights[cell.row:cell.row + cell.rowspan])
+        left = col_x[cell.col]
+        if direction == "rtl":
+            left = 2 * MARGIN + table_width - left - cell_width
+        top = row_y[cell.row]
+        draw.rectangle((left, top, left + cell_width, top + cell_height), fill=cell.fill, outline=border_color, width=border)
+        if cell.left_border > border:
+            draw.rectangle((left, top, left + cell.left_border - 1, top + cell_height), fill=border_color)
+        ascent, descent = cell.font.getmetrics()
+        y = top + (cell_height - (ascent + descent) * len(cell.lines)) // 2 + ascent
+        for line in cell.lines:
+            draw.text((left + cell_width // 2, y), line, font=cell.font, fill=cell.color, anchor="ms", direction=direction)
+            y += ascent + descent
+    buffer = io.BytesIO()
+    # Telegram recompresses photos, a faster, slightly bigger PNG is the better trade
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def weather_table(
+    days: List[str],
+    source: List[str],
+    tmin: List[float],
+    tmax: List[float],
+    rh: List[float],
+    wind_direction: List[float],
+    wind_speed: List[float],
+    rain_sum: List[float],
+    snow_sum: List[float],
+    precip_probability: List[float],
+    direct_comparisons: int,
+) -> bytes:
+    """Pillow version of `table_generator.weather_table`."""
+    head = {"fill": "#f4f7ff", "color": "#3f00e5", "size": 26, "bold": True}
+    cells = [
+        Cell(0, 0, "(٪) رطوبت", rowspan=2, **head),
+        Cell(0, 1, "بارش", colspan=3, **head),
+        Cell(0, 4, "(Km/h) باد", colspan=2, **head),
+        Cell(0, 6, "(°C) دما", colspan=2, **head),
+        Cell(0, 8, "منبع", rowspan=2, **head),
+        Cell(0, 9, "تاریخ", rowspan=2, **head),
+    ]
+    for col, text in enumerate(["(٪) احتمال", "باران\n(م م)", "برف\n(س م)", "سرعت", "جهت", "کمینه", "بیشینه"], start=1):
+        cells.append(Cell(1, col, text, **head))
+    rows = weather_rows(days, source, tmin, tmax, rh, wind_direction, wind_speed, rain_sum, snow_sum, precip_probability, direct_comparisons)
+    for i, (values, day, day_rows) in enumerate(rows):
+        body = {"fill": "#fbfbff" if i % 2 else "#aabcfe", "color": "#666699", "size": 24, "bold": True}
+        cells.extend(Cell(i + 2, col, value, **body) for col, value in enumerate(values))
+        if day is not None:
+            cells.append(Cell(i + 2, 9, day, rowspan=day_rows, **body))
+    return paint_table(cells, width=1400, border_color="#aabcfe", padding=(5, 10))
+
+
+def spring_frost_table(frost_advice: zip, messages: list[str]) -> bytes:
+    """Pillow version of `table_generator.spring_frost_table`."""
+    head = {"bold": True}
+    cells = [Cell(0, 0, "ساعت", rowspan=2, left_border=4, **head)]
+    for quarter, hours in enumerate(["0-6", "6-12", "12-18", "18-24"]):
+        cells.append(Cell(0, 1 + 2 * quarter, hours, colspan=2, left_border=4, **head))
+        cells.append(Cell(1, 1 + 2 * quarter, "احتمال\nسرمازدگی", **head))
+        cells.append(Cell(1, 2 + 2 * quarter, "وضعیت\nباد", left_border=4, **head))
+    for row, (label, *advice) in enumerate(frost_advice, start=2):
+        cells.append(Cell(row, 0, label, left_border=4, **head))
+        for quarter in range(4):
+            (frost, level), wind = frost_cells(advice[2 * quarter], advice[2 * quarter + 1])
+            cells.append(Cell(row, 1 + 2 * quarter, frost, fill=FROST_COLOURS[level]))
+            cells.append(Cell(row, 2 + 2 * quarter, wind, left_border=4))
+    return paint_table(cells, width=1024, border=2, direction="rtl")
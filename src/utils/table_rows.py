@@ -0,0 +1,57 @@
+from typing import List
+
+# row plans of the tables, shared by the HTML of table_generator and the Pillow versions in table_painter
+FROST_LEVELS = {0: ("نداریم", "green"), 1: ("کم", "yellow"), 2: ("زیاد", "orange")}
+FROST_SEVERE = ("بسیار شدید", "red")
+WIND_LEVELS = {0: "مناسب", 1: "با احتیاط"}
+WIND_BAD = "نامناسب"
+
+
+def weather_rows(
+    days: List[str],
+    source: List[str],
+    tmin: List[float],
+    tmax: List[float],
+    rh: List[float],
+    wind_direction: List[float],
+    wind_speed: List[float],
+    rain_sum: List[float],
+    snow_sum: List[float],
+    precip_probability: List[float],
+    direct_comparisons: int,
+) -> list[tuple[list, str | None, int]]:
+    """Rows of the weather table as `(values, day, day_rows)`, leaving out rows without data.
+    The first `direct_comparisons` pairs of rows share a day cell, `day` is `None` for
+    rows covered by the day cell of a row above.
+    """
+    rows = []
+    compare = 0
+    seen = set()
+    for i in range(len(tmin)):
+        values = [rh[i], precip_probability[i], rain_sum[i], snow_sum[i], wind_speed[i], wind_direction[i], tmin[i], tmax[i]]
+        if all(value == "--" for value in values):
+            continue
+        day = days[i]
+        if compare < direct_comparisons:
+            if i % 2 == 0:
+                compare += 1
+            else:
+                day = None
+        elif day in seen:
+            day = None
+        if day is not None:
+            seen.add(day)
+        rows.append([values + [source[i]], day, 1])
+    # a day cell spans the rows after it that have none
+    for i, row in enumerate(rows):
+        if row[1] is not None:
+            while i + row[2] < len(rows) and rows[i + row[2]][1] is None:
+                row[2] += 1
+    return [tuple(row) for row in rows]
+
+
+def frost_cells(temp: int, wind: int) -> tuple[tuple[str, str], str]:
+    """`((frost text, level), wind text)` of a quarter of a day in the spring frost table."""
+    frost = FROST_LEVELS.get(temp, FROST_SEVERE)
+    wind_text = "--" if temp == 0 else WIND_LEVELS.get(wind, WIND_BAD)
+    return frost, wind_text
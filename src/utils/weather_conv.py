@@ -2,12 +2,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 import datetime
 import jdatetime
-import geopandas as gpd
-import rasterio
-from rasterio.transform import rowcol
-import numpy as np
 import pandas as pd
-from shapely.geometry import Point
 from telegram import Update
 from telegram.ext import (
     CommandHandler,
@@ -18,9 +13,7 @@ from telegram.ext import (
 )
 from telegram.error import Forbidden, BadRequest
 
-import os
 from itertools import zip_longest
-from fiona.errors import DriverError
 import warnings
 import database
 from pg_sync import query_frost_temp, query_frost_wind
@@ -31,7 +24,15 @@ from .keyboards import (
     weather_keyboard
 )
 from .weather_api import get_weather_report
+from .grid_products import GridChanged, get_product
+from .farm_cells import farm_cell, require_coverage
+from .geo_pool import geo_pool, GeoPoolError, BUSY_MESSAGE
+from .geo_tasks import product_series, product_days
+from .raster_data import calculate_gdd
+from .raster_results import stored_gdd
 from .table_generator import weather_table, spring_frost_table
+from .renderer import RendererError
+from .render_cache import send_cached_photo, table_key
 from .message_generator import generate_messages
 from telegram.constants import ParseMode
 
@@ -169,73 +170,26 @@ async def recv_weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
     latitude = user_farms[farm]["location"]["latitude"]
     
     if longitude is not None:
-        if datetime.time(5, 32).strftime("%H%M") <= datetime.datetime.now().strftime("%H%M") < datetime.time(20, 30).strftime("%H%M"):    
-            try:
-                weather_data = gpd.read_file(f"data/Iran{today}_weather.geojson")
-                point = Point(longitude, latitude)
-                threshold = 0.1  # degrees
-                idx_min_dist = weather_data.geometry.distance(point).idxmin()
-                closest_coords = weather_data.geometry.iloc[idx_min_dist].coords[0]
-                if point.distance(Point(closest_coords)) <= threshold:
-                    row = weather_data.iloc[idx_min_dist]
-                    tmin_values , tmax_values , rh_values , spd_values , rain_values = [], [], [], [], []
-                    for key, value in row.items():
-                        if "tmin_Time=" in key:
-                            tmin_values.append(round(value))
-                        elif "tmax_Time=" in key:
-                            tmax_values.append(round(value))
-                        elif "rh_Time=" in key:
-                            rh_values.append(round(value))
-                        elif "spd_Time=" in key:
-                            spd_values.append(round(value))
-                        elif "rain_Time=" in key:
-                            rain_values.append(round(value))
-                    oskooei_predictions = {
-                        'tmin': tmin_values, 'tmax': tmax_values,
-                        'rh': rh_values, 'wind': spd_values,
-                        'rain': rain_values
-                    }
-                    open_meteo_predictions = db.query_weather_prediction(user.id, farm)
-                else:
-                    await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات هواشناسی باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
+        weather = get_product("weather").current()
+        if weather is not None:
+            cell = farm_cell(user.id, farm, user_farms[farm], weather)
+            if cell is not None:
+                try:
+                    series = await geo_pool.run(product_series, "weather", weather.date, cell, weather.grid.snapshot.grid_id, share=True)
+                except (GeoPoolError, GridChanged):
+                    await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
                     return ConversationHandler.END
-            except DriverError:
-                oskooei_predictions = {'tmin': [None], 'tmax': [None], 'rh': [None], 'wind': [None], 'rain': [None]}
+                oskooei_predictions = {
+                    variable: [round(value) for value in series[variable]] for variable in ['tmin', 'tmax', 'rh', 'wind', 'rain']
+                }
                 open_meteo_predictions = db.query_weather_prediction(user.id, farm)
+            else:
+                await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات هواشناسی باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
+                return ConversationHandler.END
         else:
-            try:
-                weather_data = gpd.read_file(f"data/Iran{yesterday}_weather.geojson")
-                point = Point(longitude, latitude)
-                threshold = 0.1  # degrees
-                idx_min_dist = weather_data.geometry.distance(point).idxmin()
-                closest_coords = weather_data.geometry.iloc[idx_min_dist].coords[0]
-                if point.distance(Point(closest_coords)) <= threshold:
-                    row = weather_data.iloc[idx_min_dist]
-                    tmin_values , tmax_values , rh_values , spd_values , rain_values = [], [], [], [], []
-                    for key, value in row.items():
-                        if "tmin_Time=" in key:
-                            tmin_values.append(round(value))
-                        elif "tmax_Time=" in key:
-                            tmax_values.append(round(value))
-                        elif "rh_Time=" in key:
-                            rh_values.append(round(value))
-                        elif "spd_Time=" in key:
-                            spd_values.append(round(value))
-                        elif "rain_Time=" in key:
-                            rain_values.append(round(value))
-                    oskooei_predictions = {
-                        'tmin': tmin_values[1:], 'tmax': tmax_values[1:],
-                        'rh': rh_values[1:], 'wind': spd_values[1:],
-                        'rain': rain_values[1:]
-                    }
-                    open_meteo_predictions = db.query_weather_prediction(user.id, farm)
-                else:
-                    await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات هواشناسی باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
-                    return ConversationHandler.END
-            except DriverError:
-                oskooei_predictions = {'tmin': [None], 'tmax': [None], 'rh': [None], 'wind': [None], 'rain': [None]}
-                open_meteo_predictions = db.query_weather_prediction(user.id, farm)
-                # You have created the data (oskooei & OpenMeteo, now process it):
+            oskooei_predictions = {'tmin': [None], 'tmax': [None], 'rh': [None], 'wind': [None], 'rain': [None]}
+            open_meteo_predictions = db.query_weather_prediction(user.id, farm)
+            # You have created the data (oskooei & OpenMeteo, now process it):
             
         if not open_meteo_predictions:
             farm_document = db.get_farms(user.id)[farm]
@@ -272,24 +226,33 @@ async def recv_weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
         snow_sum = [item if item is not None else "--" for item in snow_sum]
         rh = [item for pair in zip_longest(relative_humidity_values, oskooei_predictions['rh'], ) for item in pair]
         rh = [item if item else "--" for item in rh]
-        weather_table(days=days, 
-                      source=source, 
-                      tmin=tmin, 
-                      tmax=tmax, 
-                      wind_speed=wind_speed, 
-                      wind_direction=wind_direction, 
-                      precip_probability=precip_probability,
-                      rain_sum=rain_sum,
-                      snow_sum=snow_sum,
-                      rh=rh, 
-                      direct_comparisons=len([item for item in oskooei_predictions['tmin'] if item is not None]))
+        direct_comparisons = len([item for item in oskooei_predictions['tmin'] if item is not None])
         caption = f"""
 باغدار عزیز 
 پیش‌بینی وضعیت آب و هوای باغ شما با نام <b>#{farm.replace(" ", "_")}</b> در روزهای آینده بدین صورت خواهد بود
 """
-        with open('table.png', 'rb') as image_file:
-            await context.bot.send_photo(chat_id=user.id, photo=image_file, caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30)
-        os.system("rm table.png")
+        # farms in the same cell get the same table, it is rendered and uploaded once a day
+        key = table_key("weather", jtoday, days, source, tmin, tmax, wind_speed, wind_direction, precip_probability, rain_sum, snow_sum, rh, direct_comparisons)
+        try:
+            await send_cached_photo(
+                context.bot, user.id, key,
+                lambda: weather_table(days=days, 
+                          source=source, 
+                          tmin=tmin, 
+                          tmax=tmax, 
+                          wind_speed=wind_speed, 
+                          wind_direction=wind_direction, 
+                          precip_probability=precip_probability,
+                          rain_sum=rain_sum,
+                          snow_sum=snow_sum,
+                          rh=rh, 
+                          direct_comparisons=direct_comparisons),
+                caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30,
+            )
+        except RendererError as e:
+            logger.warning(f"couldn't render the weather table of {user.id}: {e}")
+            await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+            return ConversationHandler.END
         username = user.username
         db.log_new_message(
             user_id=user.id,
@@ -336,22 +299,16 @@ async def recv_sp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     longitude = user_farms[farm]["location"]["longitude"]
     latitude = user_farms[farm]["location"]["latitude"]
     if longitude is not None:
-        try:
-            if datetime.time(7, 0).strftime("%H%M") <= datetime.datetime.now().strftime("%H%M") < datetime.time(20, 30).strftime("%H%M"):    
-                sp_data = gpd.read_file(f"data/Iran{today}_AdviseSP.geojson")
-            else:
-                sp_data = gpd.read_file(f"data/Iran{yesterday}_AdviseSP.geojson")
-                day3 = day2
-                day2 = today
-                today = yesterday
-            # sp_data = gpd.read_file(f"data/pesteh{today}_AdviseSP.geojson")
-            point = Point(longitude, latitude)
-            threshold = 0.1  # degrees
-            idx_min_dist = sp_data.geometry.distance(point).idxmin()
-            closest_coords = sp_data.geometry.iloc[idx_min_dist].coords[0]
-            if point.distance(Point(closest_coords)) <= threshold:
-                row = sp_data.iloc[idx_min_dist]
-                sp_3days = [row[f'Time={today}'], row[f'Time={day2}'], row[f'Time={day3}']]
+        sp = get_product("sp").current()
+        if sp is not None:
+            cell = farm_cell(user.id, farm, user_farms[farm], sp)
+            if cell is not None:
+                try:
+                    days = await geo_pool.run(product_days, "sp", sp.date, cell, sp.grid.snapshot.grid_id, 3, share=True)
+                except (GeoPoolError, GridChanged):
+                    await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+                    return ConversationHandler.END
+                sp_3days = days["advice"]
                         # advise_3days_no_nan = ["" for text in advise_3days if pd.isna(text)]
                         # logger.info(f"{advise_3days}\n\n{advise_3days_no_nan}\n----------------------------")
                 db.set_user_attribute(user.id, f"farms.{farm}.sp-advise", {"today": sp_3days[0], "day2": sp_3days[1], "day3":sp_3days[2]})
@@ -393,8 +350,8 @@ async def recv_sp(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 await context.bot.send_message(chat_id=user.id, text="متاسفانه باغ شما از محدوده پوشش آباد خارج است.", reply_markup=db.find_start_keyboard(user.id))
                 return ConversationHandler.END
-        except DriverError:
-            logger.info(f"{user.id} requested today's weather. pesteh{today}_AdviseSP.geojson was not found!")
+        else:
+            logger.info(f"{user.id} requested today's weather. Iran{today}_AdviseSP.geojson was not found!")
             await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
             return ConversationHandler.END
     elif user_farms[farm].get("link-status") == "To be verified":
@@ -451,16 +408,24 @@ async def recv_ch(update: Update, context: ContextTypes.DEFAULT_TYPE):
 باغدار عزیز 
 پیش‌بینی سرمازدگی بهاره در باغ شما با نام <b>#{farm.replace(" ", "_")}</b> در روزهای آینده بدین صورت خواهد بود
 """
-            frost_advice = zip(
+            frost_advice = list(zip(
                 labels,
                 frost_temp[::4], frost_wind[::4], frost_temp[1::4], frost_wind[1::4], frost_temp[2::4], frost_wind[2::4], frost_temp[3::4], frost_wind[3::4]
-                )
+                ))
             messages = generate_messages(frost_temp, frost_wind, labels)
             # if messages:
             #     caption = caption + "\n" + "\n".join(messages)
-            spring_frost_table(frost_advice=frost_advice, messages=messages)
-            with open('frost-table.png', 'rb') as image_file:
-                await context.bot.send_photo(chat_id=user.id, photo=image_file, caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30)
+            key = table_key("spring-frost", jdatetime.date.today().strftime("%Y/%m/%d"), frost_advice)
+            try:
+                await send_cached_photo(
+                    context.bot, user.id, key,
+                    lambda: spring_frost_table(frost_advice=frost_advice, messages=messages),
+                    caption=caption, reply_markup=db.find_start_keyboard(user.id), parse_mode=ParseMode.HTML, read_timeout=15, write_timeout=30,
+                )
+            except RendererError as e:
+                logger.warning(f"couldn't render the spring frost table of {user.id}: {e}")
+                await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+                return ConversationHandler.END
             if messages:
                 try:
                     parsed_messages = [f"<pre>{msg}</pre>" for msg in messages]
@@ -512,15 +477,10 @@ async def recv_gdd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     latitude = user_farms[farm]["location"]["latitude"]
     if longitude is not None:
         try:
-            hours = {}
-            for method in ["GDD", "GDD2"]:
-                with rasterio.open(f"data/Daily_{method}.tif") as src:
-                    row, col = rowcol(src.transform, longitude, latitude)
-                    pixel_values = []
-                    for band in range(1, src.count + 1):
-                        pixel_values.append(src.read(band)[row, col])
-                pixel_values_filtered = np.array(pixel_values)[~np.isnan(pixel_values)]
-                hours[method] = round(sum(pixel_values_filtered))
+            require_coverage(user.id, farm, user_farms[farm], "gdd")
+            hours = stored_gdd(user.id, farm, user_farms[farm])
+            if hours is None:
+                hours = await geo_pool.run(calculate_gdd, longitude, latitude, share=True)
             
             try:
                 msg = f"""
@@ -559,6 +519,9 @@ async def recv_gdd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"{user.id} requested today's gdd advice. Geotiff file was not found!")
             await context.bot.send_message(chat_id=user.id, text="متاسفانه اطلاعات باغ شما در حال حاضر موجود نیست", reply_markup=db.find_start_keyboard(user.id))
             return ConversationHandler.END
+        except GeoPoolError:
+            await context.bot.send_message(chat_id=user.id, text=BUSY_MESSAGE, reply_markup=db.find_start_keyboard(user.id))
+            return ConversationHandler.END
     elif user_farms[farm].get("link-status") == "To be verified":
         reply_text = "لینک لوکیشن ارسال شده توسط شما هنوز تایید نشده است.\nلطفا تا بررسی ادمین آباد شکیبا باشید."
         await context.bot.send_message(chat_id=user.id, text=reply_text,reply_markup=db.find_start_keyboard(user.id))